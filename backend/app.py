@@ -1,18 +1,32 @@
 import os
-from flask import Flask, jsonify
+import time
+import hashlib
+import logging
+import threading
+from flask import Flask, jsonify, request, g
 from dotenv import load_dotenv
 
 from aps_service import (
     get_aps_token,
     create_bucket_if_needed,
     upload_file_signed_s3,
+    upload_stream_signed_s3,
+    start_direct_upload,
+    get_direct_upload_urls,
+    complete_direct_upload,
     get_signed_s3_download_url,
     get_object_details,
     to_base64_urn, 
     translate_to_viewer,
     get_manifest,
-    get_viewer_token
+    get_viewer_token,
+    start_token_refresher,
+    token_provider,
+    warm_up,
+    TOKEN_EXPIRY_MARGIN,
 )
+from aps_http import APSError, DeadlineExceeded, set_deadline, reset_deadline, breakers
+from metrics import render_prometheus
 
 load_dotenv()
 
@@ -21,6 +35,101 @@ APS_BUCKET_KEY = os.getenv("APS_BUCKET_KEY")
 
 app = Flask(__name__)
 
+logger = logging.getLogger(__name__)
+
+
+def _env_flag(name: str) -> bool:
+    return os.getenv(name, "").lower() in ("1", "true", "yes")
+
+
+# Renew APS tokens in the background so requests never wait on OAuth.
+if _env_flag("APS_TOKEN_REFRESHER"):
+    start_token_refresher()
+
+# Time budget for the APS calls of one request; routes can override it with
+# @route_deadline. Each APS call's timeouts are capped by what is left.
+REQUEST_DEADLINE = float(os.getenv("APS_REQUEST_DEADLINE", "25"))
+
+
+def route_deadline(seconds: float | None):
+    """
+    Give a route its own APS time budget (None: no deadline).
+    """
+    def decorator(view):
+        view.aps_deadline = seconds
+        return view
+    return decorator
+
+
+@app.before_request
+def _start_deadline():
+    view = app.view_functions.get(request.endpoint)
+    g.aps_deadline_token = set_deadline(getattr(view, "aps_deadline", REQUEST_DEADLINE))
+
+
+@app.teardown_request
+def _end_deadline(exc):
+    token = g.pop("aps_deadline_token", None)
+    if token is not None:
+        reset_deadline(token)
+
+
+# Set once startup warm-up has finished; reported by /api/ready.
+_ready = threading.Event()
+_warm_up_error: str | None = None
+
+
+def _run_warm_up(max_delay: float = 60) -> None:
+    global _warm_up_error
+    delay = 1.0
+    while True:
+        try:
+            warm_up()
+            _warm_up_error = None
+            _ready.set()
+            return
+        except Exception as e:
+            _warm_up_error = str(e)
+            logger.warning("APS warm-up failed, retrying in %.0fs: %s", delay, e)
+            time.sleep(delay)
+            delay = min(delay * 2, max_delay)
+
+
+# Prefetch tokens and open APS connections before taking traffic.
+if _env_flag("APS_WARMUP"):
+    threading.Thread(target=_run_warm_up, name="aps-warm-up", daemon=True).start()
+else:
+    _ready.set()
+
+
+def _error_response(e: Exception):
+    """
+    JSON error response. Upstream APS failures become 502 with the upstream
+    status, or 503 with Retry-After when APS asked us to back off or the
+    circuit breaker for that APS service is open. A spent deadline is 504.
+    """
+    if isinstance(e, DeadlineExceeded):
+        return jsonify({"error": str(e)}), 504
+    if isinstance(e, APSError):
+        body = {"error": str(e), "upstream_status": e.status_code}
+        if e.retry_after is not None:
+            resp = jsonify(body)
+            resp.status_code = 503
+            resp.headers["Retry-After"] = str(max(1, round(e.retry_after)))
+            return resp
+        return jsonify(body), 502
+    return jsonify({"error": str(e)}), 500
+
+
+@app.route("/api/ready", methods=["GET"])
+def api_ready():
+    """
+    Readiness probe: 200 once startup warm-up is done, 503 until then.
+    """
+    if _ready.is_set():
+        return jsonify({"ready": True})
+    return jsonify({"ready": False, "error": _warm_up_error}), 503
+
 
 @app.route("/api/token", methods=["GET"])
 def api_token():
@@ -37,7 +146,28 @@ def api_token():
             }
         )
     except Exception as e:
-        return jsonify({"error": str(e)}), 500
+        return _error_response(e)
+
+
+@app.route("/api/token/stats", methods=["GET"])
+def api_token_stats():
+    """
+    Token cache counters: hits, misses, refresh latency and failures.
+    """
+    return jsonify(token_provider.stats())
+
+
+@app.route("/metrics", methods=["GET"])
+def metrics():
+    """
+    Prometheus metrics: per-operation APS call latency, status codes, bytes
+    and retries, plus token cache and circuit breaker state.
+    """
+    body = render_prometheus(
+        token_provider.stats(),
+        {family: breaker.state for family, breaker in breakers.items()},
+    )
+    return app.response_class(body, mimetype="text/plain; version=0.0.4")
 
 
 @app.route("/api/oss/setup", methods=["POST"])
@@ -56,10 +186,11 @@ def api_oss_setup():
             }
         )
     except Exception as e:
-        return jsonify({"error": str(e)}), 500
+        return _error_response(e)
 
 
 @app.route("/api/oss/upload-sample", methods=["POST"])
+@route_deadline(None)
 def api_upload_sample():
     """
     Upload the local DWG example to the bucket.
@@ -69,7 +200,7 @@ def api_upload_sample():
         if not os.path.exists(sample_path):
             return jsonify({"error": f"Sample file not found at {sample_path}"}), 400
 
-        result = upload_file_signed_s3(sample_path, "sample.dwg")
+        result = upload_file_signed_s3(sample_path, "sample.dwg", resumable=True)
         return jsonify(
             {
                 "message": "sample.dwg uploaded successfully",
@@ -78,7 +209,101 @@ def api_upload_sample():
             }
         )
     except Exception as e:
-        return jsonify({"error": str(e)}), 500
+        return _error_response(e)
+
+
+@app.route("/api/oss/objects/<path:object_name>", methods=["POST"])
+@route_deadline(None)
+def api_upload_object(object_name):
+    """
+    Upload the request body as object_name, streaming it into signed S3
+    parts as it arrives (nothing is spooled to memory or disk).
+    """
+    try:
+        result = upload_stream_signed_s3(request.stream, object_name, content_length=request.content_length)
+        return jsonify(
+            {
+                "message": f"{object_name} uploaded successfully",
+                "aps_bucket_key": APS_BUCKET_KEY,
+                "result": result,
+            }
+        )
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    except Exception as e:
+        return _error_response(e)
+
+
+@app.route("/api/oss/uploads", methods=["POST"])
+def api_start_direct_upload():
+    """
+    Start a client-side upload. Body: {"objectName": ..., "size": bytes},
+    optionally with the client's "concurrency" and "throughput" (bytes/s).
+    Returns the part plan, uploadKey and the first page of signed S3 URLs;
+    the client PUTs the parts to S3 itself.
+    """
+    body = request.get_json(silent=True) or {}
+    object_name, size = body.get("objectName"), body.get("size")
+    concurrency, throughput = body.get("concurrency"), body.get("throughput")
+    if not object_name or not isinstance(size, int):
+        return jsonify({"error": "objectName and integer size are required"}), 400
+    for value in (concurrency, throughput):
+        if value is not None and (not isinstance(value, (int, float)) or isinstance(value, bool) or value <= 0):
+            return jsonify({"error": "concurrency and throughput must be positive numbers"}), 400
+    try:
+        return jsonify(start_direct_upload(
+            object_name, size,
+            concurrency=int(concurrency) if concurrency else None,
+            throughput=throughput,
+        ))
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    except Exception as e:
+        return _error_response(e)
+
+
+@app.route("/api/oss/uploads/urls", methods=["POST"])
+def api_direct_upload_urls():
+    """
+    More or refreshed signed URLs for a client-side upload.
+    Body: {"objectName", "uploadKey", "firstPart", "parts"}.
+    """
+    body = request.get_json(silent=True) or {}
+    object_name, upload_key = body.get("objectName"), body.get("uploadKey")
+    first_part, parts = body.get("firstPart"), body.get("parts", 1)
+    if not object_name or not upload_key or not isinstance(first_part, int) or not isinstance(parts, int):
+        return jsonify({"error": "objectName, uploadKey and integer firstPart/parts are required"}), 400
+    try:
+        return jsonify(get_direct_upload_urls(object_name, upload_key, first_part, parts))
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    except Exception as e:
+        return _error_response(e)
+
+
+@app.route("/api/oss/uploads/complete", methods=["POST"])
+def api_complete_direct_upload():
+    """
+    Finish a client-side upload.
+    Body: {"objectName", "uploadKey", "parts": [{"part": 1, "etag": "..."}, ...]}.
+    """
+    body = request.get_json(silent=True) or {}
+    object_name, upload_key, parts = body.get("objectName"), body.get("uploadKey"), body.get("parts")
+    if not object_name or not upload_key or not isinstance(parts, list):
+        return jsonify({"error": "objectName, uploadKey and parts are required"}), 400
+    try:
+        result = complete_direct_upload(object_name, upload_key, parts)
+        return jsonify(
+            {
+                "message": f"{object_name} uploaded successfully",
+                "aps_bucket_key": APS_BUCKET_KEY,
+                "result": result,
+            }
+        )
+    except (ValueError, KeyError, TypeError) as e:
+        return jsonify({"error": f"Invalid parts: {e}"}), 400
+    except Exception as e:
+        return _error_response(e)
 
 
 @app.route("/api/oss/download-sample", methods=["GET"])
@@ -96,7 +321,7 @@ def api_download_sample():
             }
         )
     except Exception as e:
-        return jsonify({"error": str(e)}), 500
+        return _error_response(e)
 
 
 @app.route("/api/oss/sample-urn", methods=["GET"])
@@ -118,7 +343,7 @@ def api_sample_urn():
             "details": details
         })
     except Exception as e:
-        return jsonify({"error": str(e)}), 500
+        return _error_response(e)
 
 
 
@@ -140,7 +365,7 @@ def api_translate_sample():
             "result": result
         })
     except Exception as e:
-        return jsonify({"error": str(e)}), 500
+        return _error_response(e)
 
 
 @app.route("/api/viewer/manifest-sample", methods=["GET"])
@@ -161,20 +386,37 @@ def api_manifest_sample():
             "manifest": manifest
         })
     except Exception as e:
-        return jsonify({"error": str(e)}), 500
+        return _error_response(e)
 
 
 @app.route("/api/viewer/token", methods=["GET"])
 def api_viewer_token():
+    """
+    Viewer token (viewables:read), served from the token cache.
+    expires_in is the remaining lifetime at response time and expires_at the
+    absolute expiry, and the response may be reused by the browser or a proxy
+    until shortly before the token expires.
+    """
     try:
         token = get_viewer_token()
-        return jsonify({
-            "access_token": token.get("access_token"),
-            "expires_in": token.get("expires_in"),
-            "token_type": token.get("token_type"),
-        })
+        expires_in = max(0, int(token["expires_at"] - time.time()))
+        etag = hashlib.sha256(token["access_token"].encode("utf-8")).hexdigest()[:32]
+        max_age = max(0, expires_in - TOKEN_EXPIRY_MARGIN)
+
+        if request.if_none_match.contains(etag):
+            resp = app.response_class(status=304)
+        else:
+            resp = jsonify({
+                "access_token": token.get("access_token"),
+                "expires_in": expires_in,
+                "expires_at": int(token["expires_at"]),
+                "token_type": token.get("token_type"),
+            })
+        resp.set_etag(etag)
+        resp.headers["Cache-Control"] = f"public, max-age={max_age}"
+        return resp
     except Exception as e:
-        return jsonify({"error": str(e)}), 500
+        return _error_response(e)
 
 
 @app.route("/viewer")
@@ -0,0 +1,630 @@
+import os
+import math
+import time
+import random
+import threading
+import contextvars
+import functools
+import email.utils
+from collections import deque
+from contextlib import contextmanager
+from concurrent.futures import Future, ThreadPoolExecutor, FIRST_COMPLETED, wait
+import requests
+from requests.adapters import HTTPAdapter
+
+from metrics import call_metrics
+
+# Control plane: APS REST calls (auth, OSS, Model Derivative).
+# API_TIMEOUT is the read timeout; connecting gets a much shorter budget.
+API_POOL_SIZE = int(os.getenv("APS_API_POOL_SIZE", "10"))
+API_CONNECT_TIMEOUT = float(os.getenv("APS_API_CONNECT_TIMEOUT", "5"))
+API_TIMEOUT = float(os.getenv("APS_API_TIMEOUT", "30"))
+
+# Data plane: part PUTs and downloads against signed S3 URLs. This pool
+# blocks when full, so a big upload waits for a free connection instead of
+# opening more and crowding out other traffic.
+DATA_POOL_SIZE = int(os.getenv("APS_DATA_POOL_SIZE", "8"))
+DATA_CONNECT_TIMEOUT = float(os.getenv("APS_DATA_CONNECT_TIMEOUT", "5"))
+DATA_TIMEOUT = float(os.getenv("APS_DATA_TIMEOUT", "60"))
+
+# How many distinct hosts get a pool in each session.
+HTTP_POOL_HOSTS = int(os.getenv("APS_HTTP_POOL_HOSTS", "10"))
+
+# Retries for transient failures: exponential backoff with full jitter,
+# RETRY_BASE_DELAY * 2^attempt, never waiting longer than RETRY_MAX_WAIT.
+RETRY_ATTEMPTS = int(os.getenv("APS_RETRY_ATTEMPTS", "3"))
+RETRY_BASE_DELAY = float(os.getenv("APS_RETRY_BASE_DELAY", "0.5"))
+RETRY_MAX_WAIT = float(os.getenv("APS_RETRY_MAX_WAIT", "30"))
+
+# 429 means the request was rejected unprocessed, so it is safe to retry for
+# any method; the others only for idempotent calls.
+RETRY_ALWAYS_STATUSES = {429}
+RETRY_IDEMPOTENT_STATUSES = {500, 502, 503, 504}
+IDEMPOTENT_METHODS = {"GET", "HEAD", "PUT", "DELETE", "OPTIONS"}
+
+# Client-side rate limits per APS service family as "rate/burst" in requests
+# per second, e.g. APS_RATE_LIMIT_MD="5/10". "0" disables a family's limit.
+DEFAULT_RATE_LIMITS = {
+    "auth": "5/10",
+    "oss": "25/50",
+    "md": "5/10",
+}
+
+# Request hedging for idempotent reads (off unless APS_HEDGE=1): if a call
+# has not answered by the HEDGE_PERCENTILE latency of recent calls, send a
+# second identical one and use whichever answers first. Hedges are capped at
+# HEDGE_MAX_RATE of the calls made over roughly the last HEDGE_WINDOW seconds,
+# and only start once HEDGE_MIN_SAMPLES are known.
+HEDGE_ENABLED = os.getenv("APS_HEDGE", "").lower() in ("1", "true", "yes")
+HEDGE_PERCENTILE = float(os.getenv("APS_HEDGE_PERCENTILE", "0.95"))
+HEDGE_MAX_RATE = float(os.getenv("APS_HEDGE_MAX_RATE", "0.05"))
+HEDGE_MIN_SAMPLES = int(os.getenv("APS_HEDGE_MIN_SAMPLES", "20"))
+HEDGE_WINDOW = float(os.getenv("APS_HEDGE_WINDOW", "60"))
+HEDGE_WORKERS = int(os.getenv("APS_HEDGE_WORKERS", "16"))
+
+# Circuit breaker per family: open after this many consecutive failed calls
+# (connection errors, timeouts, 5xx after all retries), then let a probe
+# through after the reset.
+BREAKER_FAILURES = int(os.getenv("APS_BREAKER_FAILURES", "5"))
+BREAKER_RESET = float(os.getenv("APS_BREAKER_RESET", "30"))
+
+
+class APSError(Exception):
+    """
+    An APS (or signed S3) call failed. status_code is the upstream HTTP
+    status, or None when no response was received.
+    """
+
+    def __init__(self, message: str, status_code: int | None = None, retry_after: float | None = None):
+        super().__init__(message)
+        self.status_code = status_code
+        self.retry_after = retry_after
+
+
+class CircuitOpenError(APSError):
+    """
+    The circuit breaker for an APS family is open; the call was not sent.
+    """
+
+
+class DeadlineExceeded(APSError):
+    """
+    The caller's deadline ran out before the APS call could be (re)tried.
+    """
+
+
+# Absolute time.monotonic() by which the current request must be done, or
+# None. Context-local, so it follows the Flask request (and asyncio tasks).
+_deadline: contextvars.ContextVar[float | None] = contextvars.ContextVar("aps_deadline", default=None)
+
+
+def set_deadline(seconds: float | None) -> contextvars.Token:
+    """
+    Give the current context seconds to finish its APS calls (None: no limit).
+    A nested deadline can only shorten an outer one. Undo with reset_deadline.
+    """
+    outer = _deadline.get()
+    new = None if seconds is None else time.monotonic() + seconds
+    if outer is not None and (new is None or new > outer):
+        new = outer
+    return _deadline.set(new)
+
+
+def reset_deadline(token: contextvars.Token) -> None:
+    _deadline.reset(token)
+
+
+@contextmanager
+def deadline(seconds: float | None):
+    token = set_deadline(seconds)
+    try:
+        yield
+    finally:
+        reset_deadline(token)
+
+
+def remaining() -> float | None:
+    """
+    Seconds left before the current deadline, or None if there is none.
+    """
+    current = _deadline.get()
+    return None if current is None else current - time.monotonic()
+
+
+def call_timeouts(connect: float, read: float) -> tuple[float, float]:
+    """
+    (connect, read) timeouts for the next call, capped by the deadline.
+    """
+    left = remaining()
+    if left is None:
+        return connect, read
+    if left <= 0:
+        raise DeadlineExceeded("Request deadline exceeded before calling APS")
+    return min(connect, left), min(read, left)
+
+
+def fits_deadline(delay: float) -> bool:
+    """
+    Whether sleeping delay seconds still leaves time for another attempt.
+    """
+    left = remaining()
+    return left is None or delay < left
+
+
+def create_session(pool_size: int, pool_hosts: int = HTTP_POOL_HOSTS, pool_block: bool = False) -> requests.Session:
+    """
+    Build a keep-alive session with a connection pool of pool_size per host.
+    """
+    s = requests.Session()
+    adapter = HTTPAdapter(pool_connections=pool_hosts, pool_maxsize=pool_size, pool_block=pool_block)
+    s.mount("https://", adapter)
+    s.mount("http://", adapter)
+    return s
+
+
+# Separate sessions so data transfers cannot starve control-plane calls
+# (token, manifest polling, ...) made by other requests in the same worker.
+api_session = create_session(API_POOL_SIZE)
+data_session = create_session(DATA_POOL_SIZE, pool_block=True)
+
+
+def warm_up_connection(url: str, timeout: float = 10) -> None:
+    """
+    Open a pooled control-plane connection to the host of url ahead of the
+    first real call. Any HTTP status is fine; only the connection matters.
+    """
+    api_session.head(url, timeout=timeout)
+
+
+class TokenBucket:
+    """
+    Thread-safe token bucket. acquire() reserves a token and sleeps until it
+    is due, so callers across threads are spaced out in arrival order.
+    """
+
+    def __init__(self, rate: float, burst: float):
+        self.rate = rate
+        self.burst = burst
+        self._tokens = burst
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def reserve(self) -> float:
+        """
+        Take a token and return how many seconds the caller must wait before
+        using it, without sleeping (for asyncio callers).
+        """
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            self._tokens -= 1
+            return -self._tokens / self.rate if self._tokens < 0 else 0.0
+
+    def refund(self) -> None:
+        """
+        Give back a reserved token that will not be used.
+        """
+        with self._lock:
+            self._tokens = min(self.burst, self._tokens + 1)
+
+    def acquire(self) -> float:
+        wait = self.reserve()
+        if wait > 0:
+            time.sleep(wait)
+        return wait
+
+
+def _create_rate_limiters() -> dict[str, TokenBucket]:
+    limiters = {}
+    for family, default in DEFAULT_RATE_LIMITS.items():
+        value = os.getenv(f"APS_RATE_LIMIT_{family.upper()}", default)
+        rate, _, burst = value.partition("/")
+        if float(rate) > 0:
+            limiters[family] = TokenBucket(float(rate), float(burst or rate))
+    return limiters
+
+
+rate_limiters = _create_rate_limiters()
+
+
+class CircuitBreaker:
+    """
+    Consecutive-failure circuit breaker. While open, calls fail fast; once
+    reset_timeout has passed a single probe call is let through, and its
+    outcome closes the breaker or opens it again.
+    """
+
+    def __init__(self, name: str, failure_threshold: int = BREAKER_FAILURES, reset_timeout: float = BREAKER_RESET):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = "closed"
+        self._failures = 0
+        self._opened_at = 0.0
+        self._lock = threading.Lock()
+
+    def before_call(self) -> None:
+        with self._lock:
+            if self.state == "closed":
+                return
+            remaining = self._opened_at + self.reset_timeout - time.monotonic()
+            if remaining <= 0:
+                # Restart the clock so a probe that never reports back
+                # does not leave the breaker half-open forever.
+                self.state = "half_open"
+                self._opened_at = time.monotonic()
+                return
+            raise CircuitOpenError(
+                f"APS {self.name} is unavailable (circuit open)",
+                retry_after=max(remaining, 1.0),
+            )
+
+    def record_success(self) -> None:
+        with self._lock:
+            self.state = "closed"
+            self._failures = 0
+
+    def record_failure(self) -> None:
+        with self._lock:
+            self._failures += 1
+            if self.state == "half_open" or self._failures >= self.failure_threshold:
+                self.state = "open"
+                self._opened_at = time.monotonic()
+
+
+breakers = {family: CircuitBreaker(family) for family in DEFAULT_RATE_LIMITS}
+
+
+class LatencyTracker:
+    """
+    Rolling window of recent latencies for one operation.
+    """
+
+    def __init__(self, window: int = 200):
+        self._samples: deque[float] = deque(maxlen=window)
+        self._lock = threading.Lock()
+
+    def record(self, seconds: float) -> None:
+        with self._lock:
+            self._samples.append(seconds)
+
+    def percentile(self, p: float) -> float | None:
+        with self._lock:
+            if len(self._samples) < HEDGE_MIN_SAMPLES:
+                return None
+            ordered = sorted(self._samples)
+        return ordered[min(len(ordered) - 1, int(p * len(ordered)))]
+
+
+_latency: dict[str, LatencyTracker] = {}
+_hedge_lock = threading.Lock()
+_hedge_counts = {"calls": 0.0, "hedges": 0.0, "updated": time.monotonic()}
+_hedge_executor = ThreadPoolExecutor(max_workers=HEDGE_WORKERS, thread_name_prefix="aps-hedge")
+_hedge_slots = threading.BoundedSemaphore(HEDGE_WORKERS)
+
+
+def _decay_hedge_counts() -> None:
+    # Exponential decay with a HEDGE_WINDOW time constant, so the rate cap
+    # follows recent traffic rather than the lifetime totals.
+    now = time.monotonic()
+    factor = math.exp(-(now - _hedge_counts["updated"]) / HEDGE_WINDOW)
+    _hedge_counts["calls"] *= factor
+    _hedge_counts["hedges"] *= factor
+    _hedge_counts["updated"] = now
+
+
+def _take_hedge_budget() -> bool:
+    with _hedge_lock:
+        _decay_hedge_counts()
+        if _hedge_counts["hedges"] + 1 > HEDGE_MAX_RATE * _hedge_counts["calls"]:
+            return False
+        _hedge_counts["hedges"] += 1
+        return True
+
+
+def _submit_hedge_task(fn) -> Future | None:
+    """
+    Run fn on the hedge pool in a copy of the caller's context, or return
+    None if no worker is free: calls never queue behind each other there.
+    """
+    if not _hedge_slots.acquire(blocking=False):
+        return None
+    future = _hedge_executor.submit(contextvars.copy_context().run, fn)
+    future.add_done_callback(lambda _: _hedge_slots.release())
+    return future
+
+
+def hedged(op: str, fn, /, *args, **kwargs):
+    """
+    Call fn(*args, **kwargs), hedging it as described at HEDGE_ENABLED.
+    op names the latency samples; it is positional-only so it can also be
+    passed through to fn (e.g. aps_http.request). fn must be idempotent.
+    The request deadline still applies to both calls.
+
+    The caller has to stay free to take whichever call answers first, so
+    when a hedge is possible the first call runs on the hedge pool. If the
+    pool has no free worker, or there are not enough samples yet, it runs
+    on the caller's thread without a hedge instead of waiting for one.
+    """
+    if not HEDGE_ENABLED:
+        return fn(*args, **kwargs)
+
+    with _hedge_lock:
+        tracker = _latency.setdefault(op, LatencyTracker())
+        _decay_hedge_counts()
+        _hedge_counts["calls"] += 1
+
+    def timed(started: float):
+        result = fn(*args, **kwargs)
+        tracker.record(time.monotonic() - started)
+        return result
+
+    delay = tracker.percentile(HEDGE_PERCENTILE)
+    started = time.monotonic()
+    primary = _submit_hedge_task(functools.partial(timed, started)) if delay is not None else None
+    if primary is None:
+        return timed(started)
+
+    futures = {primary}
+    done, _ = wait(futures, timeout=delay)
+    if not done and _take_hedge_budget():
+        hedge = _submit_hedge_task(functools.partial(timed, time.monotonic()))
+        if hedge is not None:
+            futures.add(hedge)
+
+    # First success wins; an error only counts once every attempt has failed.
+    while True:
+        done, futures = wait(futures, return_when=FIRST_COMPLETED)
+        for future in done:
+            if future.exception() is None:
+                return future.result()
+        if not futures:
+            return done.pop().result()
+
+
+def retry_after(resp: requests.Response) -> float | None:
+    """
+    Parse a Retry-After header given either in seconds or as an HTTP date.
+    """
+    value = resp.headers.get("Retry-After")
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, email.utils.parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+def backoff(attempt: int) -> float:
+    return random.uniform(0, min(RETRY_MAX_WAIT, RETRY_BASE_DELAY * 2 ** attempt))
+
+
+def _body_size(body) -> int:
+    if body is None:
+        return 0
+    if isinstance(body, str):
+        return len(body.encode("utf-8"))
+    try:
+        return memoryview(body).nbytes
+    except TypeError:
+        return 0
+
+
+class CallAttempts:
+    """
+    Retry state of one logical APS call, shared by the sync and async clients
+    so both follow the same rules (see request). The client sends, sleeps and
+    records call_metrics; this decides whether and when to try again, and
+    reports the call to the circuit breaker once, however many attempts it took:
+
+        attempts = CallAttempts(op, error, family=..., idempotent=..., timeouts=(connect, read))
+        while True:
+            sleep(attempts.admit())
+            timeouts = attempts.timeouts()
+            ... send; on a connection error or timeout: sleep(attempts.failed_to_send(e, timed_out))
+            attempts.responded(status)
+            if status in ok: attempts.finish(); return response
+            sleep(attempts.rejected(status, text, retry_after))
+    """
+
+    def __init__(
+        self,
+        op: str,
+        error: str,
+        *,
+        family: str | None,
+        idempotent: bool,
+        timeouts: tuple[float, float],
+    ):
+        self.op = op
+        self.error = error
+        self.idempotent = idempotent
+        self.connect_timeout, self.read_timeout = timeouts
+        self.limiter = rate_limiters.get(family)
+        self.breaker = breakers.get(family)
+        self.attempt = 0
+        self._timeouts = timeouts
+        self._answered = False
+        self._failed = False
+        self._finished = False
+
+    def admit(self) -> float:
+        """
+        Pass the circuit breaker and take a rate-limit token for the next
+        attempt. Returns how many seconds to wait before sending it.
+        Raises CircuitOpenError, or DeadlineExceeded if the deadline would
+        pass before the token is due.
+        """
+        try:
+            if self.breaker is not None:
+                self.breaker.before_call()
+            wait = 0.0
+            if self.limiter is not None:
+                wait = self.limiter.reserve()
+                if not fits_deadline(wait):
+                    self.limiter.refund()
+                    raise DeadlineExceeded("Request deadline exceeded waiting for the APS rate limit")
+            return wait
+        except CircuitOpenError:
+            call_metrics.observe(self.op, 0.0, "circuit_open")
+            self.finish()
+            raise
+        except DeadlineExceeded:
+            call_metrics.observe(self.op, 0.0, "deadline")
+            self.finish()
+            raise
+
+    def timeouts(self) -> tuple[float, float]:
+        """
+        (connect, read) timeouts for the attempt about to be sent, capped by
+        what is left of the deadline after any rate-limit wait.
+        """
+        try:
+            self._timeouts = call_timeouts(self.connect_timeout, self.read_timeout)
+        except DeadlineExceeded:
+            call_metrics.observe(self.op, 0.0, "deadline")
+            self.finish()
+            raise
+        return self._timeouts
+
+    def failed_to_send(self, exc: Exception, timed_out: bool) -> float:
+        """
+        The attempt got no response (connection error or timeout). Returns the
+        delay before retrying, or raises APSError if the call gives up
+        (DeadlineExceeded if the timeout was capped by the deadline).
+        """
+        # A timeout the caller's deadline cut below even the connect budget
+        # says nothing about APS; one that merely capped the read still does.
+        if not (timed_out and self._timeouts[1] < min(self.connect_timeout, self.read_timeout)):
+            self._failed = True
+        if timed_out and self._timeouts != (self.connect_timeout, self.read_timeout):
+            # The timeout was the deadline's, so the deadline is spent.
+            self.finish()
+            raise DeadlineExceeded(f"{self.error}: request deadline exceeded ({exc})") from exc
+        delay = backoff(self.attempt)
+        if not self.idempotent or self.attempt >= RETRY_ATTEMPTS or not fits_deadline(delay):
+            self.finish()
+            raise APSError(f"{self.error}: {exc}") from exc
+        return self._retry(delay)
+
+    def responded(self, status_code: int) -> None:
+        if status_code >= 500:
+            self._failed = True
+        else:
+            self._answered = True
+
+    def rejected(self, status_code: int, text: str, retry_after: float | None) -> float:
+        """
+        The attempt got a status outside ok. Returns the delay before
+        retrying, or raises APSError if the call gives up.
+        """
+        retryable = status_code in RETRY_ALWAYS_STATUSES or (
+            self.idempotent and status_code in RETRY_IDEMPOTENT_STATUSES
+        )
+        delay = retry_after if retry_after is not None else backoff(self.attempt)
+        if (
+            not retryable
+            or self.attempt >= RETRY_ATTEMPTS
+            or delay > RETRY_MAX_WAIT
+            or not fits_deadline(delay)
+        ):
+            self.finish()
+            raise APSError(f"{self.error}: {status_code} {text}", status_code, retry_after)
+        return self._retry(delay)
+
+    def finish(self) -> None:
+        """
+        Report the call to the circuit breaker: a success if any attempt got a
+        non-5xx answer, otherwise a failure if any attempt failed upstream.
+        """
+        if self.breaker is None or self._finished:
+            return
+        self._finished = True
+        if self._answered:
+            self.breaker.record_success()
+        elif self._failed:
+            self.breaker.record_failure()
+
+    def _retry(self, delay: float) -> float:
+        call_metrics.count_retry(self.op)
+        self.attempt += 1
+        return delay
+
+
+def request(
+    method: str,
+    url: str,
+    *,
+    op: str,
+    error: str,
+    ok: tuple[int, ...] = (200,),
+    session: requests.Session | None = None,
+    family: str | None = None,
+    idempotent: bool | None = None,
+    timeout: float | tuple[float, float] | None = None,
+    **kwargs,
+) -> requests.Response:
+    """
+    Send a request and return the response if its status is in ok.
+    Every attempt is recorded in call_metrics under op.
+
+    429 responses are retried for every call; 5xx responses and connection
+    errors only when the call is idempotent (by default: GET, HEAD, PUT,
+    DELETE). Retry-After is honored, otherwise backoff uses full jitter.
+    Anything else raises APSError prefixed with error.
+
+    family ("auth", "oss", "md") selects the client-side rate limiter that
+    every attempt waits on and the circuit breaker that guards it; None
+    (e.g. signed S3 URLs) uses neither. An open breaker raises
+    CircuitOpenError without sending anything.
+
+    timeout is the read timeout or a (connect, read) pair; both are capped by
+    the current deadline (see set_deadline) as left after the rate-limit
+    wait. A wait or retry that would overrun the deadline is not attempted.
+    """
+    method = method.upper()
+    session = session or api_session
+    if idempotent is None:
+        idempotent = method in IDEMPOTENT_METHODS
+    if session is data_session:
+        connect_timeout, read_timeout = DATA_CONNECT_TIMEOUT, DATA_TIMEOUT
+    else:
+        connect_timeout, read_timeout = API_CONNECT_TIMEOUT, API_TIMEOUT
+    if isinstance(timeout, tuple):
+        connect_timeout, read_timeout = timeout
+    elif timeout is not None:
+        read_timeout = timeout
+
+    attempts = CallAttempts(
+        op, error, family=family, idempotent=idempotent, timeouts=(connect_timeout, read_timeout)
+    )
+    while True:
+        wait = attempts.admit()
+        if wait > 0:
+            time.sleep(wait)
+
+        timeouts = attempts.timeouts()
+
+        started = time.monotonic()
+        try:
+            resp = session.request(method, url, timeout=timeouts, **kwargs)
+        except (requests.ConnectionError, requests.Timeout) as e:
+            call_metrics.observe(op, time.monotonic() - started, "error")
+            time.sleep(attempts.failed_to_send(e, timed_out=isinstance(e, requests.Timeout)))
+            continue
+
+        call_metrics.observe(
+            op, time.monotonic() - started, resp.status_code,
+            sent=_body_size(resp.request.body), received=len(resp.content),
+        )
+
+        attempts.responded(resp.status_code)
+        if resp.status_code in ok:
+            attempts.finish()
+            return resp
+        time.sleep(attempts.rejected(resp.status_code, resp.text, retry_after(resp)))
@@ -1,12 +1,24 @@
 import os
 import math
+import contextlib
+import mmap
+import time
+import threading
+import contextvars
 import urllib.parse
-import requests
 import base64
+import hashlib
+from concurrent.futures import Future, ThreadPoolExecutor, as_completed
 from dotenv import load_dotenv
 
 load_dotenv()
 
+from token_store import MemoryTokenStore, create_token_store
+from token_provider import TokenProvider
+from upload_journal import UploadJournal
+from upload_index import UploadIndex
+import aps_http
+
 CLIENT_ID = os.getenv("APS_CLIENT_ID")
 CLIENT_SECRET = os.getenv("APS_CLIENT_SECRET")
 APS_BUCKET_KEY = os.getenv("APS_BUCKET_KEY")
@@ -16,25 +28,98 @@ AUTH_URL = f"{APS_BASE_URL}/authentication/v2/token"
 
 # In APS Signed S3 Upload: each part except the last must be at least 5MB.
 MIN_PART_SIZE = 5 * 1024 * 1024
+# S3 limits: at most 5GB per part and 10,000 parts per upload.
+MAX_PART_SIZE = 5 * 1024 * 1024 * 1024
+MAX_PARTS = 10000
+
+# How many parts of one upload are PUT to S3 at the same time.
+UPLOAD_CONCURRENCY = int(os.getenv("APS_UPLOAD_CONCURRENCY", "4"))
+
+# Part sizing: aim for parts that take about TARGET_PART_SECONDS to PUT at
+# the measured per-connection throughput (DEFAULT_PART_THROUGHPUT bytes/s
+# until a part has been measured). Files that one connection sends within
+# SINGLE_PART_SECONDS are not split at all.
+TARGET_PART_SECONDS = float(os.getenv("APS_TARGET_PART_SECONDS", "5"))
+SINGLE_PART_SECONDS = float(os.getenv("APS_SINGLE_PART_SECONDS", "1"))
+DEFAULT_PART_THROUGHPUT = float(os.getenv("APS_DEFAULT_PART_THROUGHPUT", str(8 * 1024 * 1024)))
+
+_MIB = 1024 * 1024
+
+# APS hands out at most 25 signed URLs per signeds3upload call; larger
+# uploads fetch them in pages. URLs are requested to stay valid this long.
+SIGNED_URL_PAGE_SIZE = int(os.getenv("APS_SIGNED_URL_PAGE_SIZE", "25"))
+SIGNED_URL_MINUTES = int(os.getenv("APS_SIGNED_URL_MINUTES", "10"))
+
+# Buffer size for hashing files before upload.
+HASH_CHUNK_SIZE = 8 * 1024 * 1024
+
+# Part size for streamed uploads whose length is not known up front, and the
+# size of the reads used to fill each part from the stream.
+STREAM_PART_SIZE = int(os.getenv("APS_STREAM_PART_SIZE", str(16 * 1024 * 1024)))
+STREAM_READ_SIZE = 1024 * 1024
+
+# Attempts per part on top of the per-request retries in aps_http.request,
+# e.g. after a longer outage or when a signed URL has expired (S3 403).
+PART_ATTEMPTS = int(os.getenv("APS_PART_ATTEMPTS", "3"))
+
+# What APS answers for an expired or unknown uploadKey, or rejected ETags;
+# a resumed upload starts over on these (not on 429 or 5xx).
+STALE_UPLOAD_STATUSES = (400, 404)
+
+APS_SCOPE = "data:read data:write bucket:create bucket:read code:all"
+VIEWER_SCOPE = "viewables:read"
+
+# Cached tokens are treated as expired this many seconds before APS says so,
+# so a token is never handed out just before it stops working.
+TOKEN_EXPIRY_MARGIN = int(os.getenv("APS_TOKEN_EXPIRY_MARGIN", "60"))
+
+# The background refresher renews a token once this fraction of its lifetime
+# has passed, well before requests would see it expire.
+TOKEN_REFRESH_FRACTION = float(os.getenv("APS_TOKEN_REFRESH_FRACTION", "0.8"))
+
+token_provider = TokenProvider(
+    CLIENT_ID,
+    CLIENT_SECRET,
+    AUTH_URL,
+    create_token_store(),
+    expiry_margin=TOKEN_EXPIRY_MARGIN,
+    refresh_fraction=TOKEN_REFRESH_FRACTION,
+    session=aps_http.api_session,
+    timeout=(aps_http.API_CONNECT_TIMEOUT, aps_http.API_TIMEOUT),
+)
+
+
+def set_token_store(store: MemoryTokenStore) -> None:
+    """
+    Replace the token store, e.g. with a SqliteTokenStore shared by workers.
+    """
+    token_provider.store = store
 
 
-def get_viewer_token() -> dict:
-    if not CLIENT_ID or not CLIENT_SECRET:
-        raise RuntimeError("APS_CLIENT_ID / APS_CLIENT_SECRET are not set in .env")
-
-    headers = {"Content-Type": "application/x-www-form-urlencoded"}
-    data = {
-        "grant_type": "client_credentials",
-        "client_id": CLIENT_ID,
-        "client_secret": CLIENT_SECRET,
-        "scope": "viewables:read",
-    }
+def start_token_refresher() -> threading.Thread:
+    """
+    Keep the server and viewer tokens warm in a background thread.
+    """
+    return token_provider.start_refresher([APS_SCOPE, VIEWER_SCOPE])
+
 
-    resp = requests.post(AUTH_URL, headers=headers, data=data, timeout=30)
-    if resp.status_code == 200:
-        return resp.json()
+def stop_token_refresher() -> None:
+    token_provider.stop_refresher()
 
-    raise Exception(f"Viewer token failed: {resp.status_code} {resp.text}")
+
+def warm_up() -> None:
+    """
+    Fetch the server and viewer tokens and open a pooled connection to the
+    APS host, so the first request after startup skips DNS, TLS and OAuth.
+    """
+    get_aps_token()
+    get_viewer_token()
+    aps_http.warm_up_connection(APS_BASE_URL)
+
+
+def get_viewer_token() -> dict:
+    # Exact scope only: this token is handed to the browser.
+    return token_provider.get(VIEWER_SCOPE, allow_broader=False)
 
 
 def get_manifest(urn_encoded: str) -> dict:
@@ -46,11 +131,11 @@ def get_manifest(urn_encoded: str) -> dict:
     url = f"{APS_BASE_URL}/modelderivative/v2/designdata/{urn_encoded}/manifest"
     headers = {"Authorization": f"Bearer {access_token}"}
 
-    resp = requests.get(url, headers=headers, timeout=30)
-    if resp.status_code == 200:
-        return resp.json()
-
-    raise Exception(f"Get manifest failed: {resp.status_code} {resp.text}")
+    resp = aps_http.hedged(
+        "get_manifest", aps_http.request,
+        "GET", url, headers=headers, op="get_manifest", family="md", error="Get manifest failed",
+    )
+    return resp.json()
 
 
 def translate_to_viewer(urn_encoded: str) -> dict:
@@ -79,12 +164,11 @@ def translate_to_viewer(urn_encoded: str) -> dict:
         }
     }
 
-    resp = requests.post(url, headers=headers, json=body, timeout=30)
-
-    if resp.status_code in (200, 201):
-        return resp.json()
-
-    raise Exception(f"Translation failed: {resp.status_code} {resp.text}")
+    resp = aps_http.request(
+        "POST", url, headers=headers, json=body, ok=(200, 201), op="translate", family="md",
+        error="Translation failed",
+    )
+    return resp.json()
 
 
 def to_base64_urn(object_id: str) -> str:
@@ -111,30 +195,16 @@ def get_object_details(object_name: str) -> dict:
     url = f"{APS_BASE_URL}/oss/v2/buckets/{APS_BUCKET_KEY}/objects/{safe_object_name}/details"
     headers = {"Authorization": f"Bearer {access_token}"}
 
-    resp = requests.get(url, headers=headers, timeout=30)
-    if resp.status_code == 200:
-        return resp.json()
-
-    raise Exception(f"Get object details failed: {resp.status_code} {resp.text}")
+    resp = aps_http.hedged(
+        "get_object_details", aps_http.request,
+        "GET", url, headers=headers, op="get_object_details", family="oss",
+        error="Get object details failed",
+    )
+    return resp.json()
 
 
 def get_aps_token() -> dict:
-    if not CLIENT_ID or not CLIENT_SECRET:
-        raise RuntimeError("APS_CLIENT_ID / APS_CLIENT_SECRET are not set in .env")
-
-    headers = {"Content-Type": "application/x-www-form-urlencoded"}
-    data = {
-        "grant_type": "client_credentials",
-        "client_id": CLIENT_ID,
-        "client_secret": CLIENT_SECRET,
-        "scope": "data:read data:write bucket:create bucket:read code:all",
-    }
-
-    resp = requests.post(AUTH_URL, headers=headers, data=data, timeout=30)
-    if resp.status_code == 200:
-        return resp.json()
-
-    raise Exception(f"APS authentication failed: {resp.status_code} {resp.text}")
+    return token_provider.get(APS_SCOPE)
 
 
 def _get_access_token() -> str:
@@ -150,19 +220,19 @@ def create_bucket_if_needed() -> dict:
     headers = {"Authorization": f"Bearer {access_token}", "Content-Type": "application/json"}
     body = {"bucketKey": APS_BUCKET_KEY, "policyKey": "persistent"}
 
-    resp = requests.post(url, json=body, headers=headers, timeout=30)
+    # 200/201 success, 409 already exists, so repeating the call is safe
+    resp = aps_http.request(
+        "POST", url, json=body, headers=headers, op="create_bucket",
+        ok=(200, 201, 409), idempotent=True, family="oss", error="Bucket creation failed",
+    )
 
-    # 200/201 success, 409 already exists
-    if resp.status_code in (200, 201, 409):
-        data = {}
-        if resp.text:
-            try:
-                data = resp.json()
-            except Exception:
-                data = {"raw_text": resp.text}
-        return {"status": resp.status_code, "data": data}
-
-    raise Exception(f"Bucket creation failed: {resp.status_code} {resp.text}")
+    data = {}
+    if resp.text:
+        try:
+            data = resp.json()
+        except Exception:
+            data = {"raw_text": resp.text}
+    return {"status": resp.status_code, "data": data}
 
 
 def get_signed_s3_download_url(object_name: str, minutes_expiration: int = 10) -> dict:
@@ -180,17 +250,20 @@ def get_signed_s3_download_url(object_name: str, minutes_expiration: int = 10) -
     headers = {"Authorization": f"Bearer {access_token}"}
     params = {"minutesExpiration": minutes_expiration}
 
-    resp = requests.get(url, headers=headers, params=params, timeout=30)
-    if resp.status_code == 200:
-        return resp.json()
-
-    raise Exception(f"Signed download failed: {resp.status_code} {resp.text}")
+    resp = aps_http.request(
+        "GET", url, headers=headers, params=params, op="signed_download_url", family="oss",
+        error="Signed download failed",
+    )
+    return resp.json()
 
 
-def _get_signed_upload_urls(object_name: str, parts: int, first_part: int = 1) -> dict:
+def _get_signed_upload_urls(
+    object_name: str, parts: int, first_part: int = 1, upload_key: str | None = None
+) -> dict:
     """
     Request signed S3 upload URLs from APS.
     Endpoint: GET .../signeds3upload?parts=N&firstPart=1
+    Pass the upload_key of an upload in progress to get URLs for more of its parts.
     """
     if not APS_BUCKET_KEY:
         raise RuntimeError("APS_BUCKET_KEY is not set in .env")
@@ -200,13 +273,15 @@ def _get_signed_upload_urls(object_name: str, parts: int, first_part: int = 1) -
 
     url = f"{APS_BASE_URL}/oss/v2/buckets/{APS_BUCKET_KEY}/objects/{safe_object_name}/signeds3upload"
     headers = {"Authorization": f"Bearer {access_token}"}
-    params = {"parts": parts, "firstPart": first_part}
+    params = {"parts": parts, "firstPart": first_part, "minutesExpiration": SIGNED_URL_MINUTES}
+    if upload_key:
+        params["uploadKey"] = upload_key
 
-    resp = requests.get(url, headers=headers, params=params, timeout=30)
-    if resp.status_code == 200:
-        return resp.json()
-
-    raise Exception(f"Get signed upload URLs failed: {resp.status_code} {resp.text}")
+    resp = aps_http.request(
+        "GET", url, headers=headers, params=params, op="signed_upload_urls", family="oss",
+        error="Get signed upload URLs failed",
+    )
+    return resp.json()
 
 
 def _complete_signed_upload(object_name: str, upload_key: str, parts_payload: list[dict]) -> dict:
@@ -225,21 +300,323 @@ def _complete_signed_upload(object_name: str, upload_key: str, parts_payload: li
     headers = {"Authorization": f"Bearer {access_token}", "Content-Type": "application/json"}
     body = {"uploadKey": upload_key, "parts": parts_payload}
 
-    resp = requests.post(url, headers=headers, json=body, timeout=30)
-    if resp.status_code in (200, 201):
-        if resp.text:
-            try:
-                return resp.json()
-            except Exception:
-                return {"raw_text": resp.text}
-        return {}
+    resp = aps_http.request(
+        "POST", url, headers=headers, json=body, ok=(200, 201), op="complete_upload", family="oss",
+        error="Complete signed upload failed",
+    )
+    if resp.text:
+        try:
+            return resp.json()
+        except Exception:
+            return {"raw_text": resp.text}
+    return {}
+
+
+class _SignedUrlPager:
+    """
+    Signed upload URLs for the parts of one upload, fetched page by page.
+
+    Asking for a part's URL also starts fetching the next page in the
+    background, so control-plane latency overlaps with the part uploads.
+    Without an upload_key, the first page is fetched right away to open the
+    upload. total_parts may be None when the size is not known up front.
+    """
+
+    def __init__(
+        self,
+        object_name: str,
+        total_parts: int | None,
+        upload_key: str | None = None,
+        first_part: int = 1,
+        page_size: int = SIGNED_URL_PAGE_SIZE,
+    ):
+        self.object_name = object_name
+        self.total_parts = total_parts
+        self.upload_key = upload_key
+        self.first_part = first_part
+        self.page_size = page_size
+        self._pages: dict[int, Future] = {}
+        self._lock = threading.Lock()
+        self._fetcher = ThreadPoolExecutor(max_workers=1, thread_name_prefix="aps-upload-urls")
+
+        if upload_key is None:
+            first_page: Future = Future()
+            first_page.set_result(self._fetch(0))
+            self._pages[0] = first_page
+
+    def _has_page(self, index: int) -> bool:
+        return self.total_parts is None or self.first_part + index * self.page_size <= self.total_parts
+
+    def _fetch(self, index: int) -> list[str]:
+        first = self.first_part + index * self.page_size
+        count = self.page_size
+        if self.total_parts is not None:
+            count = min(count, self.total_parts - first + 1)
+
+        signed = _get_signed_upload_urls(
+            self.object_name, parts=count, first_part=first, upload_key=self.upload_key
+        )
+        if self.upload_key is None:
+            self.upload_key = signed.get("uploadKey")
+        urls = signed.get("urls", [])
+
+        if not self.upload_key or len(urls) != count:
+            raise Exception(f"Unexpected signed upload response: {signed}")
+        return urls
+
+    def _page(self, index: int) -> Future:
+        with self._lock:
+            page = self._pages.get(index)
+            if page is None:
+                page = self._pages[index] = self._fetcher.submit(
+                    contextvars.copy_context().run, self._fetch, index
+                )
+            return page
+
+    def url(self, part_number: int) -> str:
+        index, offset = divmod(part_number - self.first_part, self.page_size)
+        page = self._page(index)
+        # With no known total the next page may never be needed, so it is
+        # only fetched once the last fifth of this one is in use.
+        near_end = offset >= self.page_size - max(1, self.page_size // 5)
+        if self._has_page(index + 1) and (self.total_parts is not None or near_end):
+            self._page(index + 1)
+        return page.result()[offset]
+
+    def refresh(self, part_number: int) -> str:
+        """
+        Fetch a new URL for just this part of the same upload, e.g. after
+        the previous one expired.
+        """
+        signed = _get_signed_upload_urls(
+            self.object_name, parts=1, first_part=part_number, upload_key=self.upload_key
+        )
+        urls = signed.get("urls", [])
+        if len(urls) != 1:
+            raise Exception(f"Unexpected signed upload response: {signed}")
+        return urls[0]
+
+    def close(self) -> None:
+        self._fetcher.shutdown(wait=False, cancel_futures=True)
+
+
+# Exponentially weighted per-connection upload throughput (bytes/s).
+_part_throughput: float | None = None
+_part_throughput_lock = threading.Lock()
+
+
+def _record_part_throughput(nbytes: int, seconds: float) -> None:
+    global _part_throughput
+    if seconds <= 0:
+        return
+    sample = nbytes / seconds
+    with _part_throughput_lock:
+        _part_throughput = sample if _part_throughput is None else 0.8 * _part_throughput + 0.2 * sample
+
+
+def plan_parts(file_size: int, concurrency: int, throughput: float | None = None) -> tuple[int, int]:
+    """
+    Choose (part_size, total_parts) for a signed S3 upload.
+
+    Parts aim to take TARGET_PART_SECONDS each at the given (or measured)
+    throughput, but are made smaller when that leaves workers idle, and
+    larger when needed to stay within MAX_PARTS. Every part except the
+    last is between MIN_PART_SIZE and MAX_PART_SIZE.
+    """
+    throughput = throughput or _part_throughput or DEFAULT_PART_THROUGHPUT
+
+    if file_size <= min(MAX_PART_SIZE, max(MIN_PART_SIZE, throughput * SINGLE_PART_SECONDS)):
+        return file_size, 1
+
+    part_size = min(throughput * TARGET_PART_SECONDS, math.ceil(file_size / max(1, concurrency)))
+    part_size = max(part_size, MIN_PART_SIZE, math.ceil(file_size / MAX_PARTS))
+    # Whole MiB parts keep offsets page-aligned for the memory map.
+    part_size = min(math.ceil(part_size / _MIB) * _MIB, MAX_PART_SIZE)
 
-    raise Exception(f"Complete signed upload failed: {resp.status_code} {resp.text}")
+    if file_size <= part_size:
+        return file_size, 1
+    return part_size, math.ceil(file_size / part_size)
 
 
-def upload_file_signed_s3(file_path: str, object_name: str) -> dict:
+def part_retry_delay(error: aps_http.APSError, attempt: int) -> float | None:
+    """
+    What to do after attempt (counted from 1) of a part PUT failed: None to
+    retry at once with a fresh signed URL for the part, or seconds to wait
+    before retrying the same URL. Re-raises error when the part gives up.
+    Shared by the sync and async uploads.
+    """
+    if isinstance(error, aps_http.DeadlineExceeded) or attempt >= PART_ATTEMPTS:
+        raise error
+    if error.status_code == 403:
+        # The signed URL expired (or was rejected): get a fresh one for this part only.
+        return None
+    delay = aps_http.backoff(attempt)
+    if not aps_http.fits_deadline(delay):
+        raise error
+    return delay
+
+
+def _upload_part(urls: _SignedUrlPager, data: memoryview, part_number: int) -> str:
+    """
+    PUT one part to its signed S3 URL and return the part's ETag.
+    A failed part is retried on its own (PART_ATTEMPTS), with a fresh URL
+    if S3 answered 403.
+    """
+    if len(data) == 0:
+        raise Exception(f"Unexpected EOF while reading part {part_number}")
+
+    url = urls.url(part_number)
+    attempt = 1
+    while True:
+        started = time.monotonic()
+        try:
+            put_resp = aps_http.request(
+                "PUT", url, data=data, session=aps_http.data_session, op="s3_put_part",
+                ok=(200, 201), error=f"S3 PUT failed for part {part_number}",
+            )
+            break
+        except aps_http.APSError as e:
+            delay = part_retry_delay(e, attempt)
+            if delay is None:
+                url = urls.refresh(part_number)
+            else:
+                time.sleep(delay)
+            attempt += 1
+    _record_part_throughput(len(data), time.monotonic() - started)
+
+    etag = put_resp.headers.get("ETag") or put_resp.headers.get("etag")
+    if not etag:
+        raise Exception(f"Missing ETag for part {part_number}")
+    return etag.strip('"')
+
+
+def _upload_mapped_part(
+    urls: _SignedUrlPager, mm: mmap.mmap, view: memoryview, offset: int, size: int, part_number: int
+) -> str:
+    """
+    Upload a slice of the memory-mapped file without copying it, then let the
+    kernel drop those pages so resident memory does not grow with file size.
+    """
+    with view[offset:offset + size] as chunk:
+        etag = _upload_part(urls, chunk, part_number)
+    if hasattr(mmap, "MADV_DONTNEED"):
+        mm.madvise(mmap.MADV_DONTNEED, offset, size)
+    return etag
+
+
+def _upload_mapped_parts(
+    file_path: str,
+    urls: _SignedUrlPager,
+    part_size: int,
+    part_numbers: list[int],
+    concurrency: int,
+    on_part=None,
+) -> dict[int, str]:
+    """
+    Upload the given parts of a file from a memory map using a pool of
+    `concurrency` threads. Returns {part: etag}; on_part(part, etag) is called
+    from this thread as each part completes.
+    """
+    etags: dict[int, str] = {}
+    with open(file_path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        view = memoryview(mm)
+        pool = ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix="aps-upload")
+        try:
+            # Each part runs in a copy of our context so the request deadline applies.
+            futures = {
+                pool.submit(
+                    contextvars.copy_context().run,
+                    _upload_mapped_part, urls, mm, view, (n - 1) * part_size, part_size, n,
+                ): n
+                for n in part_numbers
+            }
+            for future in as_completed(futures):
+                part_number = futures[future]
+                etags[part_number] = future.result()
+                if on_part is not None:
+                    on_part(part_number, etags[part_number])
+        finally:
+            # On failure, drop the parts that have not started yet.
+            pool.shutdown(wait=True, cancel_futures=True)
+            # The map cannot be closed while a view of it is still exported.
+            view.release()
+    return etags
+
+
+_upload_index: UploadIndex | None = None
+_upload_index_lock = threading.Lock()
+
+
+def _get_upload_index() -> UploadIndex:
+    global _upload_index
+    with _upload_index_lock:
+        if _upload_index is None:
+            _upload_index = UploadIndex()
+        return _upload_index
+
+
+def _file_sha1(file_path: str) -> str:
+    """
+    SHA-1 of a file (the checksum OSS reports in object details), read
+    through one reusable buffer.
+    """
+    digest = hashlib.sha1()
+    buf = bytearray(HASH_CHUNK_SIZE)
+    view = memoryview(buf)
+    with open(file_path, "rb") as f:
+        while n := f.readinto(buf):
+            digest.update(view[:n])
+    return digest.hexdigest()
+
+
+def _find_existing_upload(object_name: str, size: int, sha1: str) -> dict | None:
+    """
+    Return what we know about object_name if it already holds this content:
+    first from the local upload index, then from the object's OSS details.
+    Every upload path in this module drops the object's index row before it
+    completes, so a row only goes stale if the object is written elsewhere.
+    """
+    index = _get_upload_index()
+    existing = index.lookup(APS_BUCKET_KEY, object_name, size, sha1)
+    if existing is not None:
+        return existing
+
+    try:
+        details = get_object_details(object_name)
+    except aps_http.APSError:
+        # Missing object (404) or OSS trouble: just upload.
+        return None
+
+    if details.get("sha1") == sha1 and details.get("size") == size:
+        index.record(APS_BUCKET_KEY, object_name, size, sha1, details)
+        return details
+    return None
+
+
+def upload_file_signed_s3(
+    file_path: str,
+    object_name: str,
+    concurrency: int | None = None,
+    resumable: bool = False,
+    dedupe: bool = True,
+) -> dict:
     """
     Upload a local file to APS OSS using Signed S3 upload flow.
+    Parts are sized by plan_parts and PUT by up to `concurrency` threads
+    (APS_UPLOAD_CONCURRENCY), straight from a memory map of the file, with
+    their signed URLs fetched a page ahead.
+
+    With resumable=True the uploadKey, part plan and every finished part's
+    ETag are journaled to disk (see UploadJournal). Calling again after a
+    crash continues from the first missing part with fresh URLs, as long as
+    the file is unchanged and APS still knows the uploadKey; if APS rejects
+    the uploadKey or a journaled ETag (400/404), the upload starts over.
+    Concurrent resumable uploads of the same file and object run one at a time.
+
+    With dedupe=True (the default) the file's SHA-1 is checked against the
+    local upload index and the object's OSS details first; if the object
+    already holds this content, nothing is uploaded and the known object
+    info (including objectId) is returned.
     """
     if not APS_BUCKET_KEY:
         raise RuntimeError("APS_BUCKET_KEY is not set in .env")
@@ -247,43 +624,260 @@ def upload_file_signed_s3(file_path: str, object_name: str) -> dict:
     if not os.path.exists(file_path):
         raise FileNotFoundError(f"File not found: {file_path}")
 
-    file_size = os.path.getsize(file_path)
+    journal = UploadJournal.for_upload(APS_BUCKET_KEY, object_name, file_path) if resumable else None
+    # A concurrent upload of the same file to the same object waits here,
+    # then resumes the journal or finds the content already uploaded.
+    with journal.lock() if journal else contextlib.nullcontext():
+        return _upload_file(file_path, object_name, concurrency or UPLOAD_CONCURRENCY, journal, dedupe)
+
+
+def _upload_file(
+    file_path: str, object_name: str, concurrency: int, journal: UploadJournal | None, dedupe: bool
+) -> dict:
+    """
+    Body of upload_file_signed_s3, run while holding the journal's lock.
+    """
+    stat = os.stat(file_path)
+    file_size = stat.st_size
+    if file_size == 0:
+        raise Exception("Unexpected EOF while reading part 1")
+
+    sha1 = None
+    if dedupe:
+        sha1 = _file_sha1(file_path)
+        existing = _find_existing_upload(object_name, file_size, sha1)
+        if existing is not None:
+            return existing
+
+    identity = {"object_name": object_name, "file_size": file_size, "mtime_ns": stat.st_mtime_ns}
+
+    while True:
+        header, etags = journal.load() if journal else (None, {})
+        if header is not None and any(header.get(k) != v for k, v in identity.items()):
+            # The file changed since the journal was written.
+            header, etags = None, {}
+
+        urls = None
+        if header is not None:
+            upload_key = header["upload_key"]
+            part_size, total_parts = header["part_size"], header["total_parts"]
+            missing = [n for n in range(1, total_parts + 1) if n not in etags]
+            if missing:
+                urls = _SignedUrlPager(object_name, total_parts, upload_key=upload_key, first_part=missing[0])
+                try:
+                    urls.url(missing[0])
+                except aps_http.APSError as e:
+                    urls.close()
+                    if e.status_code not in STALE_UPLOAD_STATUSES:
+                        raise
+                    # APS no longer knows this uploadKey, so start over.
+                    urls, header, etags = None, None, {}
+        resumed = header is not None
+
+        if header is None:
+            part_size, total_parts = plan_parts(file_size, concurrency)
+            urls = _SignedUrlPager(object_name, total_parts)
+            upload_key = urls.upload_key
+            missing = list(range(1, total_parts + 1))
+            if journal:
+                journal.start({**identity, "upload_key": upload_key, "part_size": part_size, "total_parts": total_parts})
+
+        if missing:
+            try:
+                etags.update(_upload_mapped_parts(
+                    file_path, urls, part_size, missing, concurrency,
+                    on_part=journal.record_part if journal else None,
+                ))
+            finally:
+                urls.close()
+
+        parts_payload = [{"part": n, "etag": etags[n]} for n in sorted(etags)]
+        _get_upload_index().forget(APS_BUCKET_KEY, object_name)
+        try:
+            result = _complete_signed_upload(object_name, upload_key, parts_payload)
+        except aps_http.APSError as e:
+            if not resumed or e.status_code not in STALE_UPLOAD_STATUSES:
+                raise
+            # The journaled uploadKey expired or one of its ETags is rejected:
+            # replaying the same completion would fail forever, so start over.
+            journal.remove()
+            continue
+        break
+
+    if journal:
+        journal.remove()
+    if sha1:
+        _get_upload_index().record(APS_BUCKET_KEY, object_name, file_size, sha1, result)
+    return result
+
+
+def _read_part(stream, size: int) -> bytearray:
+    """
+    Read up to size bytes from a stream; short only at end of stream.
+    """
+    buf = bytearray()
+    while len(buf) < size:
+        chunk = stream.read(min(size - len(buf), STREAM_READ_SIZE))
+        if not chunk:
+            break
+        buf += chunk
+    return buf
+
+
+def upload_stream_signed_s3(
+    stream, object_name: str, content_length: int | None = None, concurrency: int | None = None
+) -> dict:
+    """
+    Upload a readable binary stream (e.g. a request body) to APS OSS using the
+    Signed S3 upload flow, PUTting each part as soon as it has been read.
+
+    At most `concurrency` parts of STREAM_PART_SIZE are buffered or in
+    flight at a time, so memory stays flat whatever the stream length. Parts
+    are only larger when content_length needs it to stay within MAX_PARTS.
+    Without content_length, signed URLs are fetched page by page until the
+    stream ends.
+    """
+    if not APS_BUCKET_KEY:
+        raise RuntimeError("APS_BUCKET_KEY is not set in .env")
 
-    # Determine part sizes. If > 5MB then use 5MB parts.
-    if file_size <= MIN_PART_SIZE:
+    concurrency = concurrency or UPLOAD_CONCURRENCY
+    part_size, total_parts = max(STREAM_PART_SIZE, MIN_PART_SIZE), None
+    if content_length:
+        # Not plan_parts: its throughput-sized parts would buffer most of the body.
+        part_size = max(part_size, math.ceil(content_length / MAX_PARTS / _MIB) * _MIB)
+        part_size = min(part_size, content_length)
+        total_parts = math.ceil(content_length / part_size)
+
+    # Read the first part before opening the upload, so an empty body costs
+    # no APS calls and a short one is known to need a single part.
+    first = _read_part(stream, part_size)
+    if not first:
+        raise ValueError("Request body is empty")
+    if total_parts is None and len(first) < part_size:
         total_parts = 1
-        part_size = file_size
-    else:
-        total_parts = math.ceil(file_size / MIN_PART_SIZE)
-        part_size = MIN_PART_SIZE
 
-    signed = _get_signed_upload_urls(object_name, parts=total_parts, first_part=1)
+    urls = _SignedUrlPager(object_name, total_parts)
+    slots = threading.BoundedSemaphore(concurrency)
+    errors: list[BaseException] = []
+
+    def on_done(future):
+        if not future.cancelled() and future.exception() is not None:
+            errors.append(future.exception())
+        slots.release()
+
+    futures = {}
+    received = 0
+    pool = ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix="aps-upload")
+    try:
+        while True:
+            slots.acquire()
+            if errors:
+                raise errors[0]
+
+            if first is not None:
+                buf, first = first, None
+            else:
+                buf = _read_part(stream, part_size)
+            if not buf:
+                slots.release()
+                break
+            received += len(buf)
+            part_number = len(futures) + 1
+            if part_number > MAX_PARTS:
+                raise Exception(f"Stream needs more than {MAX_PARTS} parts of {part_size} bytes")
+
+            # Each part runs in a copy of our context so the request deadline applies.
+            future = pool.submit(contextvars.copy_context().run, _upload_part, urls, memoryview(buf), part_number)
+            futures[future] = part_number
+            future.add_done_callback(on_done)
+            if len(buf) < part_size:
+                break
+
+        if content_length and received != content_length:
+            raise ValueError(f"Stream ended after {received} of {content_length} bytes")
+
+        etags = {futures[future]: future.result() for future in as_completed(futures)}
+    finally:
+        # On failure, drop the parts that have not started yet.
+        pool.shutdown(wait=True, cancel_futures=True)
+        urls.close()
+
+    parts_payload = [{"part": n, "etag": etags[n]} for n in sorted(etags)]
+    # The object's content changes without a known SHA-1 to index it under.
+    _get_upload_index().forget(APS_BUCKET_KEY, object_name)
+    return _complete_signed_upload(object_name, urls.upload_key, parts_payload)
+
+
+def start_direct_upload(
+    object_name: str, size: int, concurrency: int | None = None, throughput: float | None = None
+) -> dict:
+    """
+    First step of a client-side upload: plan the parts and open the signed
+    S3 upload. The client PUTs each part straight to its URL, keeps the ETag
+    response header of each (the bucket's CORS rules must expose it), and
+    finishes with complete_direct_upload. Only the first page of URLs is
+    returned; get_direct_upload_urls hands out the rest.
+
+    Parts are planned for the client's link: its own throughput estimate
+    (bytes/s) if it sends one, else DEFAULT_PART_THROUGHPUT, never the
+    server's measured speed to S3.
+    """
+    if size <= 0:
+        raise ValueError("size must be a positive number of bytes")
+
+    part_size, total_parts = plan_parts(
+        size, concurrency or UPLOAD_CONCURRENCY, throughput=throughput or DEFAULT_PART_THROUGHPUT
+    )
+    first_page = min(total_parts, SIGNED_URL_PAGE_SIZE)
+    signed = _get_signed_upload_urls(object_name, parts=first_page, first_part=1)
     upload_key = signed.get("uploadKey")
     urls = signed.get("urls", [])
 
-    if not upload_key or len(urls) != total_parts:
+    if not upload_key or len(urls) != first_page:
         raise Exception(f"Unexpected signed upload response: {signed}")
 
-    parts_payload: list[dict] = []
+    return {
+        "objectName": object_name,
+        "uploadKey": upload_key,
+        "partSize": part_size,
+        "totalParts": total_parts,
+        "firstPart": 1,
+        "urls": urls,
+        "minutesExpiration": SIGNED_URL_MINUTES,
+    }
 
-    with open(file_path, "rb") as f:
-        for i in range(total_parts):
-            part_number = i + 1
-            chunk = f.read(part_size)
-            if chunk is None or len(chunk) == 0:
-                raise Exception(f"Unexpected EOF while reading part {part_number}")
-
-            put_resp = requests.put(urls[i], data=chunk, timeout=60)
-            if put_resp.status_code not in (200, 201):
-                raise Exception(
-                    f"S3 PUT failed for part {part_number}: {put_resp.status_code} {put_resp.text}"
-                )
 
-            etag = put_resp.headers.get("ETag") or put_resp.headers.get("etag")
-            if not etag:
-                raise Exception(f"Missing ETag for part {part_number}")
+def get_direct_upload_urls(object_name: str, upload_key: str, first_part: int, parts: int) -> dict:
+    """
+    More (or fresh, after expiry) signed URLs for a client-side upload, at
+    most SIGNED_URL_PAGE_SIZE per call.
+    """
+    if first_part < 1 or parts < 1:
+        raise ValueError("firstPart and parts must be positive")
+
+    parts = min(parts, SIGNED_URL_PAGE_SIZE)
+    signed = _get_signed_upload_urls(object_name, parts=parts, first_part=first_part, upload_key=upload_key)
+    urls = signed.get("urls", [])
+    if len(urls) != parts:
+        raise Exception(f"Unexpected signed upload response: {signed}")
+    return {"uploadKey": upload_key, "firstPart": first_part, "urls": urls}
 
-            etag = etag.strip('"')
-            parts_payload.append({"part": part_number, "etag": etag})
 
+def complete_direct_upload(object_name: str, upload_key: str, parts: list[dict]) -> dict:
+    """
+    Finalize a client-side upload from the ETags the client collected.
+    """
+    etags: dict[int, str] = {}
+    for entry in parts:
+        part_number, etag = int(entry["part"]), str(entry["etag"]).strip('"')
+        if part_number < 1 or not etag:
+            raise ValueError(f"Invalid part entry: {entry}")
+        etags[part_number] = etag
+
+    if not etags or sorted(etags) != list(range(1, len(etags) + 1)):
+        raise ValueError("parts must list every part from 1 to N exactly once")
+
+    parts_payload = [{"part": n, "etag": etags[n]} for n in sorted(etags)]
+    # The object's content changes without a known SHA-1 to index it under.
+    _get_upload_index().forget(APS_BUCKET_KEY, object_name)
     return _complete_signed_upload(object_name, upload_key, parts_payload)
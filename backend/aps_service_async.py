@@ -0,0 +1,334 @@
+import os
+import time
+import asyncio
+import urllib.parse
+import httpx
+
+import aps_http
+from aps_http import APSError
+from metrics import call_metrics
+from aps_service import (
+    APS_BASE_URL,
+    APS_BUCKET_KEY,
+    APS_SCOPE,
+    VIEWER_SCOPE,
+    SIGNED_URL_MINUTES,
+    SIGNED_URL_PAGE_SIZE,
+    part_retry_delay,
+    plan_parts,
+    token_provider,
+)
+
+# Connections to the APS host are HTTP/2, so a handful of them can carry
+# hundreds of concurrent requests.
+ASYNC_MAX_CONNECTIONS = int(os.getenv("APS_ASYNC_MAX_CONNECTIONS", "10"))
+ASYNC_MAX_CONCURRENCY = int(os.getenv("APS_ASYNC_MAX_CONCURRENCY", "200"))
+
+
+class AsyncAPSClient:
+    """
+    asyncio counterpart of aps_service, for batch work:
+
+        async with AsyncAPSClient() as aps:
+            manifests = await aps.get_manifests(urns)
+
+    Control-plane calls share an HTTP/2 client, S3 transfers use a separate
+    HTTP/1.1 client (S3 does not speak HTTP/2). Tokens come from the same
+    TokenProvider as the sync module, and calls go through the same rate
+    limiters, circuit breakers and retry policy.
+    """
+
+    def __init__(
+        self,
+        max_connections: int = ASYNC_MAX_CONNECTIONS,
+        max_concurrency: int = ASYNC_MAX_CONCURRENCY,
+    ):
+        self._api = httpx.AsyncClient(
+            http2=True,
+            limits=httpx.Limits(max_connections=max_connections),
+            timeout=aps_http.API_TIMEOUT,
+        )
+        self._data = httpx.AsyncClient(
+            limits=httpx.Limits(max_connections=aps_http.DATA_POOL_SIZE),
+            timeout=aps_http.DATA_TIMEOUT,
+        )
+        self._concurrency = asyncio.Semaphore(max_concurrency)
+
+    async def __aenter__(self) -> "AsyncAPSClient":
+        return self
+
+    async def __aexit__(self, *exc) -> None:
+        await self.aclose()
+
+    async def aclose(self) -> None:
+        await self._api.aclose()
+        await self._data.aclose()
+
+    async def _request(
+        self,
+        method: str,
+        url: str,
+        *,
+        op: str,
+        error: str,
+        ok: tuple[int, ...] = (200,),
+        family: str | None = None,
+        idempotent: bool | None = None,
+        data_plane: bool = False,
+        **kwargs,
+    ) -> httpx.Response:
+        """
+        Async version of aps_http.request, with the same retry rules and
+        deadline handling (the deadline context variable follows the task).
+        """
+        method = method.upper()
+        client = self._data if data_plane else self._api
+        if idempotent is None:
+            idempotent = method in aps_http.IDEMPOTENT_METHODS
+        if data_plane:
+            timeouts = (aps_http.DATA_CONNECT_TIMEOUT, aps_http.DATA_TIMEOUT)
+        else:
+            timeouts = (aps_http.API_CONNECT_TIMEOUT, aps_http.API_TIMEOUT)
+
+        attempts = aps_http.CallAttempts(op, error, family=family, idempotent=idempotent, timeouts=timeouts)
+        while True:
+            wait = attempts.admit()
+            if wait > 0:
+                await asyncio.sleep(wait)
+            connect, read = attempts.timeouts()
+
+            started = time.monotonic()
+            try:
+                async with self._concurrency:
+                    resp = await client.request(
+                        method, url, timeout=httpx.Timeout(read, connect=connect), **kwargs
+                    )
+            except httpx.TransportError as e:
+                call_metrics.observe(op, time.monotonic() - started, "error")
+                await asyncio.sleep(attempts.failed_to_send(e, timed_out=isinstance(e, httpx.TimeoutException)))
+                continue
+
+            call_metrics.observe(
+                op, time.monotonic() - started, resp.status_code,
+                sent=len(resp.request.content), received=len(resp.content),
+            )
+
+            attempts.responded(resp.status_code)
+            if resp.status_code in ok:
+                attempts.finish()
+                return resp
+            await asyncio.sleep(attempts.rejected(resp.status_code, resp.text, aps_http.retry_after(resp)))
+
+    async def get_aps_token(self) -> dict:
+        # Usually a cache hit; a refresh runs in a thread so the loop keeps going.
+        return await asyncio.to_thread(token_provider.get, APS_SCOPE)
+
+    async def get_viewer_token(self) -> dict:
+        return await asyncio.to_thread(token_provider.get, VIEWER_SCOPE, False)
+
+    async def _auth_headers(self) -> dict:
+        token = await self.get_aps_token()
+        return {"Authorization": f"Bearer {token['access_token']}"}
+
+    @staticmethod
+    def _object_url(object_name: str, suffix: str) -> str:
+        if not APS_BUCKET_KEY:
+            raise RuntimeError("APS_BUCKET_KEY is not set in .env")
+        safe_object_name = urllib.parse.quote(object_name, safe="")
+        return f"{APS_BASE_URL}/oss/v2/buckets/{APS_BUCKET_KEY}/objects/{safe_object_name}/{suffix}"
+
+    async def create_bucket_if_needed(self) -> dict:
+        if not APS_BUCKET_KEY:
+            raise RuntimeError("APS_BUCKET_KEY is not set in .env")
+
+        url = f"{APS_BASE_URL}/oss/v2/buckets"
+        body = {"bucketKey": APS_BUCKET_KEY, "policyKey": "persistent"}
+        resp = await self._request(
+            "POST", url, json=body, headers=await self._auth_headers(),
+            ok=(200, 201, 409), idempotent=True, op="create_bucket", family="oss",
+            error="Bucket creation failed",
+        )
+
+        data = {}
+        if resp.text:
+            try:
+                data = resp.json()
+            except Exception:
+                data = {"raw_text": resp.text}
+        return {"status": resp.status_code, "data": data}
+
+    async def get_object_details(self, object_name: str) -> dict:
+        url = self._object_url(object_name, "details")
+        resp = await self._request(
+            "GET", url, headers=await self._auth_headers(), op="get_object_details", family="oss",
+            error="Get object details failed",
+        )
+        return resp.json()
+
+    async def get_manifest(self, urn_encoded: str) -> dict:
+        url = f"{APS_BASE_URL}/modelderivative/v2/designdata/{urn_encoded}/manifest"
+        resp = await self._request(
+            "GET", url, headers=await self._auth_headers(), op="get_manifest", family="md",
+            error="Get manifest failed",
+        )
+        return resp.json()
+
+    async def get_manifests(self, urns: list[str]) -> dict:
+        """
+        Fetch many manifests concurrently. Returns {urn: manifest or APSError}.
+        """
+        results = await asyncio.gather(*(self.get_manifest(urn) for urn in urns), return_exceptions=True)
+        return dict(zip(urns, results))
+
+    async def translate_to_viewer(self, urn_encoded: str) -> dict:
+        url = f"{APS_BASE_URL}/modelderivative/v2/designdata/job"
+        body = {
+            "input": {"urn": urn_encoded},
+            "output": {"formats": [{"type": "svf2", "views": ["2d", "3d"]}]},
+        }
+        resp = await self._request(
+            "POST", url, headers=await self._auth_headers(), json=body,
+            ok=(200, 201), op="translate", family="md", error="Translation failed",
+        )
+        return resp.json()
+
+    async def get_signed_s3_download_url(self, object_name: str, minutes_expiration: int = 10) -> dict:
+        url = self._object_url(object_name, "signeds3download")
+        resp = await self._request(
+            "GET", url, headers=await self._auth_headers(), params={"minutesExpiration": minutes_expiration},
+            op="signed_download_url", family="oss", error="Signed download failed",
+        )
+        return resp.json()
+
+    async def download_file(self, object_name: str, file_path: str) -> int:
+        """
+        Download an object to file_path through a signed S3 URL.
+        Returns the number of bytes written.
+        """
+        signed = await self.get_signed_s3_download_url(object_name)
+        written = 0
+        started = time.monotonic()
+        async with self._concurrency:
+            async with self._data.stream("GET", signed["url"]) as resp:
+                if resp.status_code != 200:
+                    await resp.aread()
+                    call_metrics.observe("s3_download", time.monotonic() - started, resp.status_code)
+                    raise APSError(f"S3 download failed: {resp.status_code} {resp.text}", resp.status_code)
+                with open(file_path, "wb") as f:
+                    async for chunk in resp.aiter_bytes():
+                        f.write(chunk)
+                        written += len(chunk)
+        call_metrics.observe("s3_download", time.monotonic() - started, resp.status_code, received=written)
+        return written
+
+    async def _get_signed_upload_urls(
+        self, object_name: str, parts: int, first_part: int = 1, upload_key: str | None = None
+    ) -> dict:
+        url = self._object_url(object_name, "signeds3upload")
+        params = {"parts": parts, "firstPart": first_part, "minutesExpiration": SIGNED_URL_MINUTES}
+        if upload_key:
+            params["uploadKey"] = upload_key
+        resp = await self._request(
+            "GET", url, headers=await self._auth_headers(), params=params,
+            op="signed_upload_urls", family="oss", error="Get signed upload URLs failed",
+        )
+        return resp.json()
+
+    async def _complete_signed_upload(self, object_name: str, upload_key: str, parts_payload: list[dict]) -> dict:
+        url = self._object_url(object_name, "signeds3upload")
+        body = {"uploadKey": upload_key, "parts": parts_payload}
+        resp = await self._request(
+            "POST", url, headers=await self._auth_headers(), json=body,
+            ok=(200, 201), op="complete_upload", family="oss", error="Complete signed upload failed",
+        )
+        if resp.text:
+            try:
+                return resp.json()
+            except Exception:
+                return {"raw_text": resp.text}
+        return {}
+
+    async def upload_file_signed_s3(self, file_path: str, object_name: str) -> dict:
+        """
+        Upload a local file using the Signed S3 upload flow, PUTting up to
+        DATA_POOL_SIZE parts concurrently. Parts are sized by plan_parts and
+        their signed URLs fetched SIGNED_URL_PAGE_SIZE at a time, a page
+        ahead. A failed part is retried on its own (PART_ATTEMPTS), with a
+        fresh URL if S3 answered 403.
+        """
+        if not os.path.exists(file_path):
+            raise FileNotFoundError(f"File not found: {file_path}")
+
+        file_size = os.path.getsize(file_path)
+        if file_size == 0:
+            raise Exception("Unexpected EOF while reading part 1")
+        part_size, total_parts = plan_parts(file_size, aps_http.DATA_POOL_SIZE)
+
+        first_page = min(total_parts, SIGNED_URL_PAGE_SIZE)
+        signed = await self._get_signed_upload_urls(object_name, parts=first_page, first_part=1)
+        upload_key = signed.get("uploadKey")
+        if not upload_key or len(signed.get("urls", [])) != first_page:
+            raise Exception(f"Unexpected signed upload response: {signed}")
+
+        async def fetch_page(index: int) -> list[str]:
+            first = index * SIGNED_URL_PAGE_SIZE + 1
+            count = min(SIGNED_URL_PAGE_SIZE, total_parts - first + 1)
+            signed = await self._get_signed_upload_urls(
+                object_name, parts=count, first_part=first, upload_key=upload_key
+            )
+            urls = signed.get("urls", [])
+            if len(urls) != count:
+                raise Exception(f"Unexpected signed upload response: {signed}")
+            return urls
+
+        pages: dict[int, asyncio.Future] = {0: asyncio.get_running_loop().create_future()}
+        pages[0].set_result(signed["urls"])
+
+        async def get_url(part_number: int) -> str:
+            index, offset = divmod(part_number - 1, SIGNED_URL_PAGE_SIZE)
+            for i in (index, index + 1):
+                if i not in pages and i * SIGNED_URL_PAGE_SIZE < total_parts:
+                    pages[i] = asyncio.ensure_future(fetch_page(i))
+            return (await pages[index])[offset]
+
+        def read_part(part_number: int) -> bytes:
+            with open(file_path, "rb") as f:
+                f.seek((part_number - 1) * part_size)
+                return f.read(part_size)
+
+        # Bounds how many parts are read into memory at once.
+        in_flight = asyncio.Semaphore(aps_http.DATA_POOL_SIZE)
+
+        async def put_part(part_number: int) -> dict:
+            async with in_flight:
+                url = await get_url(part_number)
+                chunk = await asyncio.to_thread(read_part, part_number)
+                attempt = 1
+                while True:
+                    try:
+                        resp = await self._request(
+                            "PUT", url, content=chunk, data_plane=True, op="s3_put_part",
+                            ok=(200, 201), error=f"S3 PUT failed for part {part_number}",
+                        )
+                        break
+                    except APSError as e:
+                        delay = part_retry_delay(e, attempt)
+                        if delay is None:
+                            signed = await self._get_signed_upload_urls(
+                                object_name, parts=1, first_part=part_number, upload_key=upload_key
+                            )
+                            url = signed["urls"][0]
+                        else:
+                            await asyncio.sleep(delay)
+                        attempt += 1
+            etag = resp.headers.get("ETag")
+            if not etag:
+                raise Exception(f"Missing ETag for part {part_number}")
+            return {"part": part_number, "etag": etag.strip('"')}
+
+        try:
+            parts_payload = await asyncio.gather(*(put_part(n) for n in range(1, total_parts + 1)))
+        finally:
+            for page in pages.values():
+                page.cancel()
+        return await self._complete_signed_upload(object_name, upload_key, list(parts_payload))
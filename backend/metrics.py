@@ -0,0 +1,108 @@
+import threading
+
+# Upper bounds (seconds) of the latency histogram buckets.
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+
+def _labels(**labels) -> str:
+    inner = ",".join(f'{k}="{str(v)}"' for k, v in labels.items())
+    return "{" + inner + "}"
+
+
+class CallMetrics:
+    """
+    Per-operation counters for outgoing APS calls: latency histogram, status
+    codes, request/response bytes and retries. render() produces the
+    Prometheus text exposition format.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._buckets: dict[str, list[int]] = {}
+        self._latency_sum: dict[str, float] = {}
+        self._latency_count: dict[str, int] = {}
+        self._statuses: dict[tuple[str, str], int] = {}
+        self._bytes_sent: dict[str, int] = {}
+        self._bytes_received: dict[str, int] = {}
+        self._retries: dict[str, int] = {}
+
+    def observe(self, op: str, seconds: float, status: int | str, sent: int = 0, received: int = 0) -> None:
+        with self._lock:
+            buckets = self._buckets.setdefault(op, [0] * len(LATENCY_BUCKETS))
+            for i, bound in enumerate(LATENCY_BUCKETS):
+                if seconds <= bound:
+                    buckets[i] += 1
+            self._latency_sum[op] = self._latency_sum.get(op, 0.0) + seconds
+            self._latency_count[op] = self._latency_count.get(op, 0) + 1
+            key = (op, str(status))
+            self._statuses[key] = self._statuses.get(key, 0) + 1
+            self._bytes_sent[op] = self._bytes_sent.get(op, 0) + sent
+            self._bytes_received[op] = self._bytes_received.get(op, 0) + received
+
+    def count_retry(self, op: str) -> None:
+        with self._lock:
+            self._retries[op] = self._retries.get(op, 0) + 1
+
+    def render(self) -> list[str]:
+        with self._lock:
+            lines = [
+                "# HELP aps_request_duration_seconds Latency of outgoing APS calls.",
+                "# TYPE aps_request_duration_seconds histogram",
+            ]
+            for op, buckets in sorted(self._buckets.items()):
+                for bound, count in zip(LATENCY_BUCKETS, buckets):
+                    lines.append(f"aps_request_duration_seconds_bucket{_labels(op=op, le=bound)} {count}")
+                count = self._latency_count[op]
+                lines.append(f"aps_request_duration_seconds_bucket{_labels(op=op, le='+Inf')} {count}")
+                lines.append(f"aps_request_duration_seconds_sum{_labels(op=op)} {self._latency_sum[op]}")
+                lines.append(f"aps_request_duration_seconds_count{_labels(op=op)} {count}")
+
+            lines += [
+                "# HELP aps_requests_total Outgoing APS calls by response status.",
+                "# TYPE aps_requests_total counter",
+            ]
+            for (op, status), count in sorted(self._statuses.items()):
+                lines.append(f"aps_requests_total{_labels(op=op, status=status)} {count}")
+
+            for name, help_text, values in (
+                ("aps_request_bytes_total", "Request body bytes sent to APS.", self._bytes_sent),
+                ("aps_response_bytes_total", "Response body bytes received from APS.", self._bytes_received),
+                ("aps_retries_total", "Retried APS calls.", self._retries),
+            ):
+                lines += [f"# HELP {name} {help_text}", f"# TYPE {name} counter"]
+                for op, value in sorted(values.items()):
+                    lines.append(f"{name}{_labels(op=op)} {value}")
+        return lines
+
+
+call_metrics = CallMetrics()
+
+
+def render_prometheus(token_stats: dict, breaker_states: dict[str, str]) -> str:
+    """
+    Full /metrics payload: call metrics, token cache counters and the state
+    of each circuit breaker (0 closed, 1 half-open, 2 open).
+    """
+    lines = call_metrics.render()
+
+    lines += ["# HELP aps_token_cache_total Token cache lookups by result.", "# TYPE aps_token_cache_total counter"]
+    for result in ("hits", "broader_hits", "misses"):
+        lines.append(f"aps_token_cache_total{_labels(result=result)} {token_stats[result]}")
+    lines += [
+        "# HELP aps_token_refreshes_total Tokens fetched from APS.",
+        "# TYPE aps_token_refreshes_total counter",
+        f"aps_token_refreshes_total {token_stats['refreshes']}",
+        "# HELP aps_token_failures_total Failed token fetches.",
+        "# TYPE aps_token_failures_total counter",
+        f"aps_token_failures_total {token_stats['failures']}",
+        "# HELP aps_token_refresh_seconds_total Time spent fetching tokens.",
+        "# TYPE aps_token_refresh_seconds_total counter",
+        f"aps_token_refresh_seconds_total {token_stats['refresh_seconds_total']}",
+    ]
+
+    states = {"closed": 0, "half_open": 1, "open": 2}
+    lines += ["# HELP aps_circuit_state Circuit breaker state per APS family.", "# TYPE aps_circuit_state gauge"]
+    for family, state in sorted(breaker_states.items()):
+        lines.append(f"aps_circuit_state{_labels(family=family)} {states[state]}")
+
+    return "\n".join(lines) + "\n"
@@ -0,0 +1,26 @@
+from app import app
+
+# Routes that go through every APS call path (token, signed upload, object
+# details, translation, manifest), run in order against the account in .env.
+ROUTES = [
+    ("POST", "/api/oss/setup"),
+    ("POST", "/api/oss/upload-sample"),
+    ("GET", "/api/oss/sample-urn"),
+    ("POST", "/api/viewer/translate-sample"),
+    ("GET", "/api/viewer/manifest-sample"),
+    ("GET", "/api/viewer/token"),
+]
+
+def smoke_check():
+    client = app.test_client()
+    failed = False
+    for method, path in ROUTES:
+        resp = client.open(path, method=method)
+        print(resp.status_code, method, path)
+        if resp.status_code >= 500:
+            print("  ", resp.get_json())
+            failed = True
+    return failed
+
+if __name__ == "__main__":
+    raise SystemExit(1 if smoke_check() else 0)
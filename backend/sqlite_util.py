@@ -0,0 +1,53 @@
+import os
+import sqlite3
+import threading
+from contextlib import contextmanager
+
+
+def connect(path: str, timeout: float = 5) -> sqlite3.Connection:
+    return sqlite3.connect(path, timeout=timeout, isolation_level=None, check_same_thread=False)
+
+
+def create_private(path: str) -> None:
+    """
+    Create path if needed and make it readable by the owner only. SQLite
+    gives its -wal and -shm files the mode of the database file.
+    """
+    fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o600)
+    os.close(fd)
+    os.chmod(path, 0o600)
+
+
+class LocalConnection:
+    """
+    One connection to a SQLite file per thread, reopened after a fork.
+    """
+
+    def __init__(self, path: str, timeout: float = 5):
+        self.path = path
+        self.timeout = timeout
+        self._local = threading.local()
+
+    def get(self) -> sqlite3.Connection:
+        # Connections must not cross a fork, so they are keyed by pid as well as thread.
+        if getattr(self._local, "pid", None) != os.getpid():
+            self._local.pid = os.getpid()
+            self._local.conn = connect(self.path, self.timeout)
+        return self._local.conn
+
+
+@contextmanager
+def exclusive_lock(path: str, timeout: float):
+    """
+    Hold a lock shared by every process on the host: a write transaction on
+    the SQLite file at path, which SQLite releases if the holder dies.
+    Waits up to timeout seconds, then raises sqlite3.OperationalError.
+    """
+    conn = connect(path, timeout=timeout)
+    try:
+        conn.execute("BEGIN IMMEDIATE")
+        yield
+    finally:
+        if conn.in_transaction:
+            conn.execute("ROLLBACK")
+        conn.close()
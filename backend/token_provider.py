@@ -0,0 +1,207 @@
+import time
+import logging
+import threading
+import requests
+
+import aps_http
+from token_store import MemoryTokenStore
+
+logger = logging.getLogger(__name__)
+
+
+def normalize_scope(scope: str) -> str:
+    """
+    Canonical form of a scope string: de-duplicated and sorted, so
+    "data:write data:read" and "data:read data:write" share a cache entry.
+    """
+    return " ".join(sorted(set(scope.split())))
+
+
+class TokenProvider:
+    """
+    Hands out APS 2-legged tokens per scope set.
+
+    Tokens are cached in a token store until shortly before they expire,
+    refreshes are single-flight per scope, and a cached token with a broader
+    scope is reused when it covers the requested one. Counters are available
+    from stats().
+    """
+
+    def __init__(
+        self,
+        client_id: str | None,
+        client_secret: str | None,
+        auth_url: str,
+        store: MemoryTokenStore,
+        expiry_margin: int = 60,
+        refresh_fraction: float = 0.8,
+        session: requests.Session | None = None,
+        timeout: float | tuple[float, float] = 30,
+    ):
+        self.client_id = client_id
+        self.client_secret = client_secret
+        self.auth_url = auth_url
+        self.store = store
+        self.expiry_margin = expiry_margin
+        self.refresh_fraction = refresh_fraction
+        self.session = session or requests.Session()
+        self.timeout = timeout
+
+        self._stats_lock = threading.Lock()
+        self._stats = {
+            "hits": 0,
+            "broader_hits": 0,
+            "misses": 0,
+            "refreshes": 0,
+            "failures": 0,
+            "refresh_seconds_total": 0.0,
+            "refresh_seconds_max": 0.0,
+        }
+
+        self._refresher: threading.Thread | None = None
+        self._refresher_stop = threading.Event()
+
+    def _count(self, name: str, amount: float = 1) -> None:
+        with self._stats_lock:
+            self._stats[name] += amount
+
+    def stats(self) -> dict:
+        with self._stats_lock:
+            stats = dict(self._stats)
+        requests_total = stats["hits"] + stats["broader_hits"] + stats["misses"]
+        stats["hit_ratio"] = (stats["hits"] + stats["broader_hits"]) / requests_total if requests_total else 0.0
+        stats["refresh_seconds_avg"] = (
+            stats["refresh_seconds_total"] / stats["refreshes"] if stats["refreshes"] else 0.0
+        )
+        return stats
+
+    def _is_fresh(self, token: dict | None) -> bool:
+        return token is not None and token["expires_at"] - self.expiry_margin > time.time()
+
+    def _refresh_at(self, token: dict) -> float:
+        issued_at = token.get("issued_at", token["expires_at"] - int(token.get("expires_in", 0)))
+        return issued_at + (token["expires_at"] - issued_at) * self.refresh_fraction
+
+    def _request_token(self, scope: str) -> dict:
+        """
+        POST client credentials to APS and return the token dict, stamped with
+        the absolute times at which it was issued and expires.
+        """
+        if not self.client_id or not self.client_secret:
+            raise RuntimeError("APS_CLIENT_ID / APS_CLIENT_SECRET are not set in .env")
+
+        headers = {"Content-Type": "application/x-www-form-urlencoded"}
+        data = {
+            "grant_type": "client_credentials",
+            "client_id": self.client_id,
+            "client_secret": self.client_secret,
+            "scope": scope,
+        }
+
+        started = time.monotonic()
+        try:
+            # Client-credential grants have no side effects, so retrying is safe.
+            resp = aps_http.request(
+                "POST", self.auth_url, headers=headers, data=data, op="authenticate",
+                session=self.session, timeout=self.timeout, family="auth", idempotent=True,
+                error=f"APS authentication failed for scope '{scope}'",
+            )
+        except Exception:
+            self._count("failures")
+            raise
+
+        elapsed = time.monotonic() - started
+        with self._stats_lock:
+            self._stats["refreshes"] += 1
+            self._stats["refresh_seconds_total"] += elapsed
+            self._stats["refresh_seconds_max"] = max(self._stats["refresh_seconds_max"], elapsed)
+
+        token = resp.json()
+        token["issued_at"] = time.time()
+        token["expires_at"] = token["issued_at"] + int(token.get("expires_in", 0))
+        return token
+
+    def _find_broader(self, scope: str) -> dict | None:
+        wanted = set(scope.split())
+        for cached_scope in self.store.scopes():
+            if cached_scope != scope and wanted <= set(cached_scope.split()):
+                token = self.store.get(cached_scope)
+                if self._is_fresh(token):
+                    return token
+        return None
+
+    def get(self, scope: str, allow_broader: bool = True) -> dict:
+        """
+        Return a valid token for the scope, calling APS only on a cache miss.
+        Pass allow_broader=False for tokens that leave the server (e.g. the
+        viewer token sent to the browser), so they never carry extra scopes.
+        """
+        scope = normalize_scope(scope)
+        store = self.store
+
+        token = store.get(scope)
+        if self._is_fresh(token):
+            self._count("hits")
+            return token
+
+        if allow_broader:
+            token = self._find_broader(scope)
+            if token is not None:
+                self._count("broader_hits")
+                return token
+
+        with store.lock(scope):
+            # Another caller may have refreshed while we were waiting on the lock.
+            token = store.get(scope)
+            if self._is_fresh(token):
+                self._count("hits")
+                return token
+
+            self._count("misses")
+            token = self._request_token(scope)
+            store.put(scope, token)
+            return token
+
+    def refresh_if_due(self, scope: str) -> dict:
+        """
+        Renew the token for a scope once it is past its refresh point. Re-checked
+        under the store lock, so workers sharing a store renew it only once.
+        """
+        scope = normalize_scope(scope)
+        with self.store.lock(scope):
+            token = self.store.get(scope)
+            if token is not None and time.time() < self._refresh_at(token):
+                return token
+
+            token = self._request_token(scope)
+            self.store.put(scope, token)
+            return token
+
+    def start_refresher(self, scopes: list[str], retry_delay: float = 5, max_sleep: float = 60) -> threading.Thread:
+        """
+        Start a daemon thread that renews the tokens for the given scopes at
+        refresh_fraction of their lifetime, so requests keep hitting the cache.
+        Calling it again returns the already running thread.
+        """
+        if self._refresher is not None and self._refresher.is_alive():
+            return self._refresher
+
+        def run():
+            while not self._refresher_stop.is_set():
+                next_refresh = time.time() + max_sleep
+                for scope in scopes:
+                    try:
+                        token = self.refresh_if_due(scope)
+                        next_refresh = min(next_refresh, self._refresh_at(token))
+                    except Exception as e:
+                        logger.warning("Token refresh for %r failed: %s", scope, e)
+                        next_refresh = min(next_refresh, time.time() + retry_delay)
+                self._refresher_stop.wait(max(1.0, next_refresh - time.time()))
+
+        self._refresher_stop.clear()
+        self._refresher = threading.Thread(target=run, name="aps-token-refresher", daemon=True)
+        self._refresher.start()
+        return self._refresher
+
+    def stop_refresher(self) -> None:
+        self._refresher_stop.set()
@@ -0,0 +1,95 @@
+import os
+import json
+import hashlib
+import threading
+from contextlib import contextmanager
+
+from sqlite_util import LocalConnection, connect, create_private, exclusive_lock
+
+
+class MemoryTokenStore:
+    """
+    Per-process token store. Tokens live in a dict and refreshes are
+    serialized with one lock per scope.
+    """
+
+    def __init__(self):
+        self._tokens: dict[str, dict] = {}
+        self._locks: dict[str, threading.Lock] = {}
+        self._guard = threading.Lock()
+
+    def get(self, scope: str) -> dict | None:
+        return self._tokens.get(scope)
+
+    def put(self, scope: str, token: dict) -> None:
+        self._tokens[scope] = token
+
+    def scopes(self) -> list[str]:
+        return list(self._tokens)
+
+    @contextmanager
+    def lock(self, scope: str):
+        with self._guard:
+            lock = self._locks.get(scope)
+            if lock is None:
+                lock = self._locks[scope] = threading.Lock()
+        with lock:
+            yield
+
+
+class SqliteTokenStore(MemoryTokenStore):
+    """
+    Token store shared by every process on the host through a SQLite file in
+    WAL mode, so worker processes reuse each other's tokens.
+
+    Refreshes are serialized across processes by holding a write transaction
+    on a sibling "<path>.lock-<scope hash>" database, one per scope; SQLite
+    releases it if the holder dies. The files hold bearer tokens, so they
+    are created readable by the owner only.
+    """
+
+    def __init__(self, path: str):
+        super().__init__()
+        self.path = path
+        self._conn = LocalConnection(path)
+
+        create_private(path)
+        conn = connect(path)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("CREATE TABLE IF NOT EXISTS tokens (scope TEXT PRIMARY KEY, token TEXT NOT NULL)")
+        conn.close()
+
+    def get(self, scope: str) -> dict | None:
+        row = self._conn.get().execute("SELECT token FROM tokens WHERE scope = ?", (scope,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def put(self, scope: str, token: dict) -> None:
+        self._conn.get().execute(
+            "INSERT OR REPLACE INTO tokens (scope, token) VALUES (?, ?)",
+            (scope, json.dumps(token)),
+        )
+
+    def scopes(self) -> list[str]:
+        return [row[0] for row in self._conn.get().execute("SELECT scope FROM tokens")]
+
+    @contextmanager
+    def lock(self, scope: str):
+        # Threads of this process queue on the in-process lock first, so only
+        # one connection per process waits on the file lock.
+        with super().lock(scope):
+            lock_path = f"{self.path}.lock-{hashlib.sha256(scope.encode('utf-8')).hexdigest()[:16]}"
+            create_private(lock_path)
+            with exclusive_lock(lock_path, timeout=120):
+                yield
+
+
+def create_token_store() -> MemoryTokenStore:
+    """
+    Build the token store configured in .env.
+    APS_TOKEN_STORE_PATH set -> SQLite file shared between processes,
+    otherwise tokens are cached per process.
+    """
+    path = os.getenv("APS_TOKEN_STORE_PATH")
+    if path:
+        return SqliteTokenStore(path)
+    return MemoryTokenStore()
@@ -0,0 +1,54 @@
+import os
+import json
+import tempfile
+
+from sqlite_util import LocalConnection, connect
+
+INDEX_PATH = os.getenv("APS_UPLOAD_INDEX_PATH", os.path.join(tempfile.gettempdir(), "aps-upload-index.sqlite"))
+
+
+class UploadIndex:
+    """
+    Local record of what was last uploaded to each object: its size, SHA-1
+    and the APS response. Kept in a SQLite file in WAL mode so every worker
+    process on the host shares it.
+    """
+
+    def __init__(self, path: str = INDEX_PATH):
+        self.path = path
+        self._conn = LocalConnection(path)
+
+        conn = connect(path)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS uploads ("
+            " bucket_key TEXT NOT NULL, object_name TEXT NOT NULL,"
+            " size INTEGER NOT NULL, sha1 TEXT NOT NULL, result TEXT NOT NULL,"
+            " PRIMARY KEY (bucket_key, object_name))"
+        )
+        conn.close()
+
+    def lookup(self, bucket_key: str, object_name: str, size: int, sha1: str) -> dict | None:
+        """
+        The stored result if this exact content was last uploaded to the object.
+        """
+        row = self._conn.get().execute(
+            "SELECT result FROM uploads WHERE bucket_key = ? AND object_name = ? AND size = ? AND sha1 = ?",
+            (bucket_key, object_name, size, sha1),
+        ).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def record(self, bucket_key: str, object_name: str, size: int, sha1: str, result: dict) -> None:
+        self._conn.get().execute(
+            "INSERT OR REPLACE INTO uploads (bucket_key, object_name, size, sha1, result) VALUES (?, ?, ?, ?, ?)",
+            (bucket_key, object_name, size, sha1, json.dumps(result)),
+        )
+
+    def forget(self, bucket_key: str, object_name: str) -> None:
+        """
+        Drop what is known about an object whose content is being replaced.
+        """
+        self._conn.get().execute(
+            "DELETE FROM uploads WHERE bucket_key = ? AND object_name = ?",
+            (bucket_key, object_name),
+        )
@@ -0,0 +1,99 @@
+import os
+import json
+import stat
+import hashlib
+import tempfile
+from contextlib import contextmanager
+
+from sqlite_util import exclusive_lock
+
+JOURNAL_DIR = os.getenv("APS_UPLOAD_JOURNAL_DIR", os.path.join(tempfile.gettempdir(), "aps-upload-journals"))
+# How long an upload waits for another one using the same journal.
+JOURNAL_LOCK_TIMEOUT = float(os.getenv("APS_UPLOAD_JOURNAL_LOCK_TIMEOUT", "3600"))
+
+
+def _private_dir(path: str) -> None:
+    """
+    Create path readable by this user only, and refuse one that another
+    user owns: journals decide which uploadKey and ETags a resume trusts.
+    """
+    os.makedirs(path, mode=0o700, exist_ok=True)
+    st = os.lstat(path)
+    if not stat.S_ISDIR(st.st_mode) or (hasattr(os, "getuid") and st.st_uid != os.getuid()):
+        raise PermissionError(f"Upload journal directory {path} is not a directory owned by this user")
+    if stat.S_IMODE(st.st_mode) & 0o077:
+        os.chmod(path, 0o700)
+
+
+class UploadJournal:
+    """
+    On-disk checkpoint of one signed S3 upload, as JSON lines: a header with
+    the upload plan (uploadKey, part size, part count and the file identity),
+    then one line per completed part with its ETag. Lines are appended and
+    synced as parts finish, so a crash loses at most the part in flight; a
+    torn last line is ignored on load.
+
+    Hold lock() while using a journal: two uploads writing the same journal
+    would mix parts from different uploadKeys.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+
+    @classmethod
+    def for_upload(cls, bucket_key: str, object_name: str, file_path: str) -> "UploadJournal":
+        key = f"{bucket_key}/{object_name}/{os.path.abspath(file_path)}"
+        name = hashlib.sha256(key.encode("utf-8")).hexdigest()[:32] + ".jsonl"
+        return cls(os.path.join(JOURNAL_DIR, name))
+
+    @contextmanager
+    def lock(self, timeout: float = JOURNAL_LOCK_TIMEOUT):
+        """
+        Exclusive across threads and processes; released if the holder dies.
+        """
+        _private_dir(os.path.dirname(self.path))
+        with exclusive_lock(self.path + ".lock", timeout=timeout):
+            yield
+
+    def load(self) -> tuple[dict | None, dict[int, str]]:
+        """
+        Return (header, {part: etag}), or (None, {}) if there is no journal.
+        """
+        if not os.path.exists(self.path):
+            return None, {}
+
+        header = None
+        etags: dict[int, str] = {}
+        with open(self.path, "r", encoding="utf-8") as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    break
+                if header is None:
+                    header = entry
+                else:
+                    etags[entry["part"]] = entry["etag"]
+        return header, etags
+
+    def _append(self, entry: dict, mode: str = "a") -> None:
+        with open(self.path, mode, encoding="utf-8") as f:
+            f.write(json.dumps(entry) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+
+    def start(self, header: dict) -> None:
+        """
+        Begin a new journal, replacing any previous one.
+        """
+        _private_dir(os.path.dirname(self.path))
+        self._append(header, mode="w")
+
+    def record_part(self, part: int, etag: str) -> None:
+        self._append({"part": part, "etag": etag})
+
+    def remove(self) -> None:
+        try:
+            os.remove(self.path)
+        except FileNotFoundError:
+            pass